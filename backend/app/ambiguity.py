@@ -0,0 +1,118 @@
+# app/ambiguity.py
+import os
+from typing import List, Optional
+
+from .lexical import content_terms
+from .metrics import Counter
+
+# Top similarity below which the question is too far from every chunk to answer
+AMBIGUITY_MIN_SCORE = float(os.getenv("AMBIGUITY_MIN_SCORE", "0.25"))
+# Top similarity above which the best match is trusted even with close runners-up
+AMBIGUITY_CONFIDENT_SCORE = float(os.getenv("AMBIGUITY_CONFIDENT_SCORE", "0.5"))
+# Chunks scoring within this much of the top one compete with it
+AMBIGUITY_MARGIN = float(os.getenv("AMBIGUITY_MARGIN", "0.03"))
+AMBIGUITY_MAX_OPTIONS = int(os.getenv("AMBIGUITY_MAX_OPTIONS", "3"))
+# Phrase clarifications with an extra Gemini call instead of from the sources
+CLARIFY_WITH_LLM = os.getenv("CLARIFY_WITH_LLM", "0") == "1"
+
+clarifications = Counter(
+    "rag_clarifications_total",
+    "Questions answered with a clarification, by reason (low_confidence or competing_sources).",
+)
+
+
+def _score(chunk: dict) -> float:
+    return chunk.get("similarity") or 0
+
+
+def _title(chunk: dict) -> Optional[str]:
+    source = chunk.get("source") or (chunk.get("metadata") or {}).get("source")
+    if not source:
+        return None
+    name = os.path.basename(source)
+    return name[:-4] if name.lower().endswith(".pdf") else name
+
+
+def _options(chunks: List[dict]) -> List[dict]:
+    """
+    Best-scoring page of each distinct source, highest first.
+    """
+    options, seen = [], set()
+    for chunk in sorted(chunks, key=_score, reverse=True):
+        title = _title(chunk)
+        if title and title not in seen:
+            seen.add(title)
+            options.append({"source": title, "page": chunk.get("page")})
+    return options
+
+
+def assess(chunks: List[dict], question: str = "") -> dict:
+    """
+    Decides from the retrieval scores alone whether the question should be
+    clarified before answering: a weak top match, or several sources
+    scoring about as well as the top one without any of them being a
+    confident match.
+    """
+    scores = sorted((_score(c) for c in chunks), reverse=True)
+    top = scores[0] if scores else 0.0
+    competing = [c for c in chunks if _score(c) >= top - AMBIGUITY_MARGIN]
+    competing_sources = _options(competing)
+    all_sources = _options(chunks)
+
+    # A chunk containing every query term (course code, room, date) is enough
+    # to answer, if the query says more than one word or the chunk is also
+    # the best semantic match; a lone common word matches too much
+    specific = len(content_terms(question)) >= 2
+    top_chunk = max(chunks, key=_score) if chunks else None
+    exact_keyword_hit = any(
+        (c.get("lexical_coverage") or 0) >= 1.0 and (specific or c is top_chunk) for c in chunks
+    )
+
+    if exact_keyword_hit:
+        reason = None
+    elif top < AMBIGUITY_MIN_SCORE:
+        reason = "low_confidence"
+    elif top < AMBIGUITY_CONFIDENT_SCORE and len(competing_sources) > 1:
+        reason = "competing_sources"
+    else:
+        reason = None
+
+    options = competing_sources if reason == "competing_sources" else all_sources
+    return {
+        "ambiguous": reason is not None,
+        "reason": reason,
+        "top_score": round(top, 4),
+        # Top-1 vs top-k: near zero when nothing stands out
+        "gap": round(top - scores[-1], 4) if scores else 0.0,
+        "sources": len(all_sources),
+        "competing_sources": len(competing_sources),
+        "options": options[:AMBIGUITY_MAX_OPTIONS],
+    }
+
+
+def _option_text(option: dict) -> str:
+    if option.get("page") is None:
+        return f'"{option["source"]}"'
+    return f'"{option["source"]}" (page {option["page"] + 1})'
+
+
+def _listed(items: List[str], conjunction: str) -> str:
+    if len(items) < 2:
+        return "".join(items)
+    return ", ".join(items[:-1]) + f" {conjunction} {items[-1]}"
+
+
+def clarification_question(question: str, assessment: dict) -> str:
+    """
+    Clarifying question built from the assessed options, without an LLM call.
+    """
+    options = [_option_text(o) for o in assessment["options"]]
+    if assessment["reason"] == "competing_sources":
+        return (f"Your question matches several documents equally well. Do you mean {_listed(options, 'or')}? "
+                "Naming the document or adding a detail such as a course code or date will help.")
+    if options:
+        return (f'I couldn\'t find a close match for "{question}". '
+                f"The nearest passages are in {_listed(options, 'and')}. "
+                "Is your question about one of these, or could you add a detail such as a course code or date?")
+    return (f'I couldn\'t find a close match for "{question}" in your documents. '
+            "Could you add a detail such as a course code, document name or date?")
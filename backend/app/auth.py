@@ -8,6 +8,7 @@ from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from .db import supabase
+from .cache import TTLCache
 from fastapi.responses import RedirectResponse
 from fastapi import Cookie, Header
 
@@ -18,6 +19,13 @@ GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI")
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
 JWT_ISSUER = os.getenv("JWT_ISSUER", "campus-agent")
 JWT_AUDIENCE = os.getenv("JWT_AUDIENCE", "campus-agent-users")
+# Verified token -> claims; entries are re-checked against exp on every hit
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+JWT_CACHE_TTL = float(os.getenv("JWT_CACHE_TTL", "300"))
+
+# HMAC state keyed with JWT_SECRET, copied per token instead of re-keying
+_jwt_hmac = hmac.new(JWT_SECRET.encode(), digestmod=hashlib.sha256)
+verified_tokens = TTLCache(maxsize=JWT_CACHE_SIZE, ttl=JWT_CACHE_TTL)
 
 auth_router = APIRouter(prefix="/auth", tags=["auth"])
 bearer_scheme = HTTPBearer(auto_error=True)
@@ -35,6 +43,9 @@ class TokenResponse(BaseModel):
     token: str
     user: User
 
+def _hmac_for(secret: str):
+    return _jwt_hmac.copy() if secret == JWT_SECRET else hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
 def _b64url(data: bytes) -> str:
     return base64.urlsafe_b64encode(data).rstrip(b"=").decode("utf-8")
 
@@ -43,7 +54,9 @@ def _sign_jwt(payload: Dict[str, Any], secret: str) -> str:
     h_b64 = _b64url(json.dumps(header, separators=(",", ":")).encode())
     p_b64 = _b64url(json.dumps(payload, separators=(",", ":")).encode())
     signing_input = f"{h_b64}.{p_b64}".encode()
-    sig = hmac.new(secret.encode(), signing_input, hashlib.sha256).digest()
+    mac = _hmac_for(secret)
+    mac.update(signing_input)
+    sig = mac.digest()
     s_b64 = _b64url(sig)
     return f"{h_b64}.{p_b64}.{s_b64}"
 
@@ -55,7 +68,9 @@ def _verify_jwt(token: str, secret: str) -> Dict[str, Any]:
         h_b64, p_b64, s_b64 = parts
         signing_input = f"{h_b64}.{p_b64}".encode()
         sig = base64.urlsafe_b64decode(s_b64 + "==")
-        expected = hmac.new(secret.encode(), signing_input, hashlib.sha256).digest()
+        mac = _hmac_for(secret)
+        mac.update(signing_input)
+        expected = mac.digest()
         if not hmac.compare_digest(sig, expected):
             raise ValueError("Signature mismatch")
         payload = json.loads(base64.urlsafe_b64decode(p_b64 + "=="))
@@ -68,6 +83,21 @@ def _verify_jwt(token: str, secret: str) -> Dict[str, Any]:
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
 
+def _verify_jwt_cached(token: str) -> Dict[str, Any]:
+    """
+    _verify_jwt for JWT_SECRET with an LRU of verified tokens. A cached
+    token past its exp is re-verified, so it fails exactly as before.
+    """
+    payload = verified_tokens.get(token)
+    if payload is not None:
+        exp = payload.get("exp")
+        if not exp or int(time.time()) <= exp:
+            return payload
+        verified_tokens.delete(token)
+    payload = _verify_jwt(token, JWT_SECRET)
+    verified_tokens.set(token, payload)
+    return payload
+
 def create_jwt(user_id: str) -> str:
     now = int(time.time())
     payload = {
@@ -92,7 +122,7 @@ async def get_current_user(
     else:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    payload = _verify_jwt(token, JWT_SECRET)
+    payload = _verify_jwt_cached(token)
     return {"user_id": payload["user_id"]}
 
 @auth_router.get("/google/login")
@@ -0,0 +1,228 @@
+# app/cache.py
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+_MISSING = object()
+
+
+def normalize_query(text: str) -> str:
+    """
+    Canonical form of a question used for cache keys:
+    lowercased, whitespace collapsed, trailing punctuation removed.
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?!.")
+
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache with a per-entry time to live.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SQLiteCache:
+    """
+    On-disk cache shared by every process that opens the same file.
+    Values are stored as JSON; the least recently used rows are evicted
+    once the table grows past max_rows.
+    """
+
+    def __init__(self, path: str, table: str = "cache", max_rows: int = 100_000, ttl: Optional[float] = None):
+        self.path = path
+        self.table = table
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table}(accessed_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row and (row[1] is None or row[1] > now):
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+        if row:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        self.misses += 1
+        return default
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        conn = self._conn()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), expires_at, now),
+        )
+        # Cheap probabilistic trim instead of counting rows on every write
+        if hash(key) % 64 == 0:
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        count = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if count > self.max_rows:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_rows,),
+            )
+
+    def delete(self, key: str):
+        self._conn().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self):
+        self._conn().execute(f"DELETE FROM {self.table}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class TieredCache:
+    """
+    In-process TTLCache in front of an optional shared SQLiteCache.
+    Shared hits are promoted into the in-process tier.
+    """
+
+    def __init__(self, memory: TTLCache, shared: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.shared = shared
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return self.get_shared(key, default)
+
+    def get_shared(self, key: str, default: Any = None) -> Any:
+        """
+        Looks in the shared tier only, promoting a hit. For callers that
+        already missed in memory and do the SQLite read off the event loop.
+        """
+        if self.shared is not None:
+            value = self.shared.get(key, _MISSING)
+            if value is not _MISSING:
+                self.memory.set(key, value)
+                return value
+        return default
+
+    def set(self, key: str, value: Any):
+        self.memory.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def delete(self, key: str):
+        self.memory.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        shared = self.shared.stats() if self.shared is not None else None
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + (shared["hits"] if shared else 0)
+        return {
+            "memory": memory,
+            "shared": shared,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+def make_cache(maxsize: int, ttl: Optional[float], path: str = "", table: str = "cache",
+               max_rows: int = 100_000) -> TieredCache:
+    """
+    Builds a TieredCache; the shared SQLite tier is only enabled when a path is given.
+    """
+    shared = None
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        shared = SQLiteCache(path, table=table, max_rows=max_rows, ttl=ttl)
+    return TieredCache(TTLCache(maxsize=maxsize, ttl=ttl), shared)
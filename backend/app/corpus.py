@@ -0,0 +1,56 @@
+# app/corpus.py
+import os
+import sqlite3
+import threading
+import uuid
+
+# Set this (to the same file in every worker) so all workers agree on versions
+CORPUS_VERSION_PATH = os.getenv("CORPUS_VERSION_PATH", os.getenv("RESPONSE_CACHE_PATH", ""))
+
+_lock = threading.Lock()
+_local = threading.local()
+# user_id -> version, used when no shared path is configured
+_versions = {}
+# Where versions come from: in-process versions restart at 0 and differ
+# between workers, so anything handed to clients (ETags) must carry this
+VERSION_SCOPE = "shared" if CORPUS_VERSION_PATH else uuid.uuid4().hex[:12]
+
+
+def _conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CORPUS_VERSION_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS corpus_versions (user_id TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+
+def corpus_version(user_id: str) -> int:
+    """
+    Current version of a user's document set. Anything cached from the
+    user's documents should include this in its key.
+    """
+    if not CORPUS_VERSION_PATH:
+        return _versions.get(user_id, 0)
+    row = _conn().execute("SELECT version FROM corpus_versions WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_corpus_version(user_id: str) -> int:
+    """
+    Marks a user's documents as changed (upload finished, files deleted).
+    """
+    if not CORPUS_VERSION_PATH:
+        with _lock:
+            _versions[user_id] = _versions.get(user_id, 0) + 1
+            return _versions[user_id]
+    conn = _conn()
+    conn.execute(
+        "INSERT INTO corpus_versions (user_id, version) VALUES (?, 1) "
+        "ON CONFLICT(user_id) DO UPDATE SET version = version + 1",
+        (user_id,),
+    )
+    return corpus_version(user_id)
@@ -0,0 +1,52 @@
+# app/filelock.py
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+
+class FileLock:
+    """
+    Re-entrant lock that is held across threads and, where fcntl exists,
+    across processes (e.g. several uvicorn workers sharing an index directory).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fh = None
+
+    @property
+    def thread_lock(self) -> threading.RLock:
+        """
+        The in-process part of the lock, for readers that only need to
+        exclude other threads of this process. Taking the FileLock takes it too.
+        """
+        return self._lock
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            if self._depth == 0:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._fh = open(self.path, "a")
+                if fcntl:
+                    fcntl.flock(self._fh, fcntl.LOCK_EX)
+            self._depth += 1
+        except Exception:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._fh, fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
+        self._lock.release()
@@ -1,9 +1,17 @@
 #  CHECKPOINT WORKING Fully functional
 import os
+import re
+import time
+import hashlib
 from dotenv import load_dotenv
 from .db import supabase
-from langchain_community.document_loaders import PyPDFLoader
+from .retrieval import index_chunks
+from .quota import quota, BACKGROUND, is_rate_limited, retry_after_seconds
+from .cache import make_cache
+from .vector_index import _parse_embedding
+from .metrics import observe_stage
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from .pdf_extract import iter_pages, page_count
 from os.path import basename
 import google.generativeai as genai
 
@@ -13,37 +21,301 @@ load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=GOOGLE_API_KEY)
 
+EMBEDDING_MODEL = "models/embedding-001"
+# The same scheduler query embeddings use; ingestion waits behind them
+embed_quota = quota("embed", EMBEDDING_MODEL)
+# embedContent accepts up to 100 contents per batch request
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "500"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "4"))
+EMBED_BACKOFF_SECONDS = float(os.getenv("EMBED_BACKOFF_SECONDS", "1.0"))
+
+# Filter values per PostgREST request when looking chunks up by hash
+HASH_LOOKUP_BATCH_SIZE = 200
+HASH_LOOKUP_PAGE_SIZE = 1000
+
+# content hash -> embedding, shared by all users (same text, same vector)
+chunk_embedding_cache = make_cache(
+    maxsize=int(os.getenv("CHUNK_EMBED_CACHE_SIZE", "50000")),
+    ttl=None,
+    path=os.getenv("CHUNK_EMBED_CACHE_PATH", ""),
+    table="chunk_embeddings",
+    max_rows=int(os.getenv("CHUNK_EMBED_CACHE_MAX_ROWS", "1000000")),
+)
+
 print("Using Google GenAI embeddings with API key...")
 
-def process_document(file_path: str, user_id: str, file_id: str):
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=50)
-    chunks = splitter.split_documents(documents)
+def _batches(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _rate(count: int, seconds: float) -> float:
+    return count / seconds if seconds > 0 else float("inf")
+
+
+def _embed_batch(batch: list) -> list:
+    """
+    Embeds one batch, retrying with exponential backoff on failure. Runs
+    at background priority, so queries are served first from the shared quota.
+    """
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        embed_quota.acquire(BACKGROUND)
+        try:
+            embedding_resp = genai.embed_content(model=EMBEDDING_MODEL, content=batch)
+            return embedding_resp["embedding"]
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = EMBED_BACKOFF_SECONDS * (2 ** attempt)
+            if is_rate_limited(e):
+                # Everyone using the quota waits it out; the next acquire blocks until then
+                delay = retry_after_seconds(text=str(e)) or delay
+                print(f"Embedding quota exhausted, pausing {delay:.1f}s...")
+                embed_quota.throttle(delay)
+                continue
+            print(f"Embedding batch failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+
+def embed_texts(texts: list) -> list:
+    """
+    Embeds a list of texts with one API call per EMBED_BATCH_SIZE texts.
+    Returns embeddings in the same order as the input.
+    """
+    embeddings = []
+    for batch in _batches(texts, EMBED_BATCH_SIZE):
+        embeddings.extend(_embed_batch(batch))
+    return embeddings
+
+
+def insert_chunk_rows(rows: list):
+    """
+    Inserts chunk rows in bulk, INSERT_BATCH_SIZE rows per request.
+    """
+    for batch in _batches(rows, INSERT_BATCH_SIZE):
+        supabase.table("chunks").insert(batch).execute()
+
+
+def _iter_chunks(file_path: str, splitter, pages: int):
+    """
+    Yields (page_number, chunk) in document order, one page at a time, so
+    only the pages being extracted are held in memory.
+    """
+    for page, text in iter_pages(file_path, pages):
+        for chunk in splitter.create_documents([text], metadatas=[{"source": file_path, "page": page}]):
+            yield page, chunk
+
+
+def _iter_batches(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def content_hash(text: str) -> str:
+    """
+    Hash of a chunk's whitespace-normalized text, stored in its metadata.
+    """
+    return hashlib.sha256(re.sub(r"\s+", " ", text).strip().encode("utf-8")).hexdigest()
+
 
-    filename_only = basename(file_path)
+def _cache_key(digest: str) -> str:
+    return f"{EMBEDDING_MODEL}:{digest}"
 
-    for idx, chunk in enumerate(chunks):
-        page = chunk.metadata.get("page", None)
 
-        # Generate embedding using Gemini
-        embedding_resp = genai.embed_content(
-            model="models/embedding-001",
-            content=chunk.page_content
-        )
-        embedding = embedding_resp["embedding"]
+def _load_file_chunks(file_ids: list) -> dict:
+    """
+    content hash -> stored row for the given files' chunks, paged in id
+    order so no row is skipped or repeated between pages.
+    """
+    rows, start = {}, 0
+    while file_ids:
+        resp = supabase.table("chunks").select("content, embedding, metadata, file_id") \
+            .in_("file_id", list(file_ids)).order("id") \
+            .range(start, start + HASH_LOOKUP_PAGE_SIZE - 1).execute()
+        for row in resp.data or []:
+            digest = (row.get("metadata") or {}).get("content_hash")
+            if digest:
+                row["embedding"] = _parse_embedding(row["embedding"])
+                rows.setdefault(digest, row)
+        if len(resp.data or []) < HASH_LOOKUP_PAGE_SIZE:
+            break
+        start += HASH_LOOKUP_PAGE_SIZE
+    return rows
 
-        supabase.table("chunks").insert({
-            "content": chunk.page_content,
-            "embedding": embedding,
+
+def _known_embeddings(user_id: str, digests: list) -> dict:
+    """
+    Embeddings for already seen chunk texts: the shared hash cache first,
+    then the user's stored chunks.
+    """
+    found = {}
+    for digest in digests:
+        embedding = chunk_embedding_cache.get(_cache_key(digest))
+        if embedding is not None:
+            found[digest] = embedding
+    missing = [d for d in digests if d not in found]
+    for batch in _batches(missing, HASH_LOOKUP_BATCH_SIZE):
+        resp = supabase.table("chunks").select("embedding, metadata").eq("user_id", user_id) \
+            .in_("metadata->>content_hash", batch).execute()
+        for row in resp.data or []:
+            digest = row["metadata"]["content_hash"]
+            if digest not in found:
+                found[digest] = _parse_embedding(row["embedding"])
+                chunk_embedding_cache.set(_cache_key(digest), found[digest])
+    return found
+
+
+def _embed_new(user_id: str, batch: list, stats: dict) -> list:
+    """
+    Embeddings for a batch of (digest, text), calling the API only for
+    texts whose hash has not been seen before.
+    """
+    known = _known_embeddings(user_id, [digest for digest, _ in batch])
+    todo = [(digest, text) for digest, text in batch if digest not in known]
+    if todo:
+        t0 = time.perf_counter()
+        embeddings = _embed_batch([text for _, text in todo])
+        stats["embed_seconds"] += time.perf_counter() - t0
+        for (digest, _), embedding in zip(todo, embeddings):
+            known[digest] = embedding
+            chunk_embedding_cache.set(_cache_key(digest), embedding)
+    stats["embedded"] += len(todo)
+    stats["reused_embeddings"] += len(batch) - len(todo)
+    return [known[digest] for digest, _ in batch]
+
+
+def _copy_unchanged(user_id: str, file_id: str, source: str, previous: dict, kept: dict):
+    """
+    Stores the previous version's unchanged chunks again under file_id with
+    their new page numbers and chunk indexes, reusing the stored text and
+    embedding. The old rows are not touched, so a failed upload leaves the
+    previous version intact; the caller deletes it once the new one is
+    complete.
+    """
+    rows = []
+    for digest, (page, index) in kept.items():
+        row = previous[digest]
+        rows.append({
+            "content": row["content"],
+            "embedding": row["embedding"],
             "user_id": user_id,
             "file_id": file_id,
-            "metadata": {
-                "source": filename_only,
-                "page_number": page,
-                "chunk_index": idx
-            }
-        }).execute()
-
-    print(f"Inserted {len(chunks)} chunks from {file_path} for user {user_id}, file_id={file_id}.")
+            "metadata": {**row["metadata"], "source": source, "page_number": page, "chunk_index": index},
+        })
+    for batch in _batches(rows, INSERT_BATCH_SIZE):
+        insert_chunk_rows(batch)
+        index_chunks(user_id, batch)
+
+
+def process_document(file_path: str, user_id: str, file_id: str, progress=None, source_name: str = None,
+                     previous_file_ids: list = ()) -> dict:
+    """
+    Parses, embeds and stores a PDF page by page. If given,
+    progress(chunks_done=..., pages_done=..., pages_total=...) is called each
+    time a batch of chunks has been stored. source_name (default: the file's
+    basename) is stored as each chunk's source.
+
+    Chunks are keyed by content hash: repeats within the file are stored
+    once, known texts reuse their embedding, and chunks unchanged from
+    previous_file_ids (an older version of the same file) are copied over
+    without being embedded again. The caller deletes the previous files
+    afterwards.
+    """
+    stats = {"parse_seconds": 0.0, "embed_seconds": 0.0, "insert_seconds": 0.0,
+             "embedded": 0, "reused_embeddings": 0, "unchanged": 0, "duplicates": 0}
+    source = source_name or basename(file_path)
+    pages_total = page_count(file_path)
+    if progress:
+        progress(chunks_done=0, pages_done=0, pages_total=pages_total)
+
+    previous = _load_file_chunks(previous_file_ids)
+    # content hash -> (page, chunk index), for chunks carried over from the previous version
+    kept = {}
+    seen = set()
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=50)
+
+    def new_chunks():
+        # Stored and carried-over chunks share one numbering, in document order
+        for page, chunk in _iter_chunks(file_path, splitter, pages_total):
+            digest = content_hash(chunk.page_content)
+            if digest in seen:
+                stats["duplicates"] += 1
+                continue
+            index = len(seen)
+            seen.add(digest)
+            if digest in previous:
+                kept[digest] = (page, index)
+                continue
+            yield page, digest, chunk, index
+
+    done = 0
+    pending = []
+    pages_done = 0
+    batches = _iter_batches(new_chunks(), EMBED_BATCH_SIZE)
+    while True:
+        t0 = time.perf_counter()
+        batch = next(batches, None)
+        stats["parse_seconds"] += time.perf_counter() - t0
+
+        if batch:
+            # Only texts not seen before are sent to Gemini, one request per batch
+            embeddings = _embed_new(user_id, [(digest, chunk.page_content) for _, digest, chunk, _ in batch], stats)
+
+            for (page, digest, chunk, index), embedding in zip(batch, embeddings):
+                pending.append({
+                    "content": chunk.page_content,
+                    "embedding": embedding,
+                    "user_id": user_id,
+                    "file_id": file_id,
+                    "metadata": {
+                        "source": source,
+                        "page_number": page,
+                        "chunk_index": index,
+                        "content_hash": digest
+                    }
+                })
+            pages_done = max(pages_done, (batch[-1][0] or 0) + 1)
+
+        if pending and (len(pending) >= INSERT_BATCH_SIZE or not batch):
+            t0 = time.perf_counter()
+            insert_chunk_rows(pending)
+            index_chunks(user_id, pending)
+            stats["insert_seconds"] += time.perf_counter() - t0
+            done += len(pending)
+            pending = []
+            if progress:
+                progress(chunks_done=done, pages_done=pages_done, pages_total=pages_total)
+        if not batch:
+            break
+
+    if kept:
+        t0 = time.perf_counter()
+        _copy_unchanged(user_id, file_id, source, previous, kept)
+        stats["insert_seconds"] += time.perf_counter() - t0
+    stats["unchanged"] = len(kept)
+    total = done + len(kept)
+
+    if progress:
+        progress(chunks_done=total, chunks_total=total, pages_done=pages_total, pages_total=pages_total)
+    stats["pages"] = pages_total
+    stats["chunks"] = total
+    for stage in ("parse", "embed", "insert"):
+        observe_stage(f"ingest_{stage}", stats[f"{stage}_seconds"])
+    print(f"Inserted {done} chunks ({len(kept)} unchanged copied) from {source} for user {user_id}, file_id={file_id}.")
+    print(
+        f"  parse: {pages_total} pages in {stats['parse_seconds']:.2f}s "
+        f"({_rate(pages_total, stats['parse_seconds']):.1f} pages/s) | "
+        f"embed: {stats['embedded']} new, {stats['reused_embeddings']} reused, "
+        f"{_rate(stats['embedded'], stats['embed_seconds']):.1f} chunks/s | "
+        f"insert: {_rate(done, stats['insert_seconds']):.1f} rows/s"
+    )
+    return stats
@@ -0,0 +1,128 @@
+# app/jobs.py
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+from .db import supabase
+from .ingest import process_document
+from .corpus import bump_corpus_version
+from .response_cache import response_cache
+from .retrieval import remove_files
+
+# Number of documents ingested at the same time
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Queued + running jobs accepted before /upload starts rejecting
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "16"))
+# Finished jobs are kept this long so clients can poll their final status
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+_slots = threading.BoundedSemaphore(INGEST_MAX_PENDING)
+_lock = threading.Lock()
+# job_id -> job record
+jobs: Dict[str, Dict[str, Any]] = {}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _update(job_id: str, **fields):
+    with _lock:
+        jobs[job_id].update(fields)
+
+
+def _prune_finished():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with _lock:
+        expired = [
+            jid for jid, job in jobs.items()
+            if job["finished_at"] and job["finished_at"] < cutoff
+        ]
+        for jid in expired:
+            del jobs[jid]
+
+
+def _run_job(job_id: str, file_path: str, user_id: str, file_id: str, filename: str, previous_file_ids: list):
+    try:
+        _update(job_id, status="running", started_at=time.time())
+
+        def on_progress(**fields):
+            _update(job_id, **fields)
+
+        stats = process_document(file_path, user_id=user_id, file_id=file_id, progress=on_progress,
+                                 source_name=filename, previous_file_ids=previous_file_ids)
+        if previous_file_ids:
+            # The new version is complete (unchanged chunks were copied), so the old ones can go
+            supabase.table("chunks").delete().in_("file_id", previous_file_ids).execute()
+            supabase.table("files").delete().in_("file_id", previous_file_ids).execute()
+            remove_files(user_id, previous_file_ids)
+        _update(job_id, status="completed", stats=stats, finished_at=time.time())
+    except Exception as e:
+        # cleanup if chunks fail; the previous versions are still whole
+        supabase.table("chunks").delete().eq("file_id", file_id).execute()
+        supabase.table("files").delete().eq("file_id", file_id).execute()
+        remove_files(user_id, [file_id])
+        _update(job_id, status="failed", error=str(e), finished_at=time.time())
+    finally:
+        # Chunks were added (or rolled back), so cached answers are stale
+        bump_corpus_version(user_id)
+        response_cache.invalidate_user(user_id)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        _slots.release()
+
+
+def submit_ingest_job(file_path: str, user_id: str, file_id: str, filename: str,
+                      previous_file_ids: Optional[List[str]] = None) -> str:
+    """
+    Queues a document for background ingestion and returns its job id.
+    The job owns file_path from here on and deletes it when it finishes.
+    previous_file_ids are older versions of the same file, replaced once
+    the new one is stored.
+    Raises QueueFullError when INGEST_MAX_PENDING jobs are already pending.
+    """
+    _prune_finished()
+    if not _slots.acquire(blocking=False):
+        raise QueueFullError("Ingestion queue is full, try again later.")
+
+    job_id = uuid.uuid4().hex
+    with _lock:
+        jobs[job_id] = {
+            "job_id": job_id,
+            "user_id": user_id,
+            "file_id": file_id,
+            "filename": filename,
+            "status": "queued",
+            "chunks_done": 0,
+            "chunks_total": None,
+            "pages_done": 0,
+            "pages_total": None,
+            "error": None,
+            "stats": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+    try:
+        _executor.submit(_run_job, job_id, file_path, user_id, file_id, filename, previous_file_ids or [])
+    except Exception:
+        with _lock:
+            del jobs[job_id]
+        _slots.release()
+        raise
+    return job_id
+
+
+def get_job(job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns a copy of the job record if it exists and belongs to the user.
+    """
+    with _lock:
+        job = jobs.get(job_id)
+        if not job or job["user_id"] != user_id:
+            return None
+        return dict(job)
@@ -0,0 +1,306 @@
+# app/lexical.py
+import json
+import math
+import os
+import pickle
+import re
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .filelock import FileLock
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "lexical_index")
+LEXICAL_INDEX_MAX_USERS = int(os.getenv("LEXICAL_INDEX_MAX_USERS", "256"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Words like "cs-301", "12/03/2025", "lab2", "3.5"
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-/.:][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by do does for from how i in is it me of on or the "
+    "to was what when where which who why will with my our your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Compound tokens such as "cs-301" are kept whole
+    and also indexed as "cs301", "cs" and "301" so any spelling matches.
+    """
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        if tok in _STOPWORDS:
+            continue
+        tokens.append(tok)
+        parts = re.split(r"[-/.:]", tok)
+        if len(parts) > 1:
+            tokens.append("".join(parts))
+            tokens.extend(p for p in parts if p not in _STOPWORDS)
+    return tokens
+
+
+def content_terms(text: str) -> List[str]:
+    """
+    Distinct words of text that are not stopwords, compounds not split.
+    """
+    return list(dict.fromkeys(tok for tok in _TOKEN_RE.findall(text.lower()) if tok not in _STOPWORDS))
+
+
+class LexicalIndex:
+    """
+    Per-user BM25 inverted index.
+
+    Files in the user's directory:
+      docs.jsonl     - one JSON line per chunk: file_id, content, source, metadata
+      postings.pkl   - term -> (array('I') doc ids, array('H') term freqs),
+                       doc lengths, byte offsets of each doc in docs.jsonl
+                       and the inode of the docs.jsonl they point into
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.docs_path = os.path.join(path, "docs.jsonl")
+        self.postings_path = os.path.join(path, "postings.pkl")
+        self._flock = FileLock(os.path.join(path, ".lock"))
+        self._lock = self._flock.thread_lock
+        self._loaded_stamp = None
+        self._reset()
+
+    def _reset(self):
+        self.postings: Dict[str, tuple] = {}
+        self.doc_lengths = array("I")
+        self.offsets = array("Q")
+        self.file_ids: List[str] = []
+        self.docs_ino = None
+        self.avgdl = 0.0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.postings_path)
+
+    def _file_lock(self) -> FileLock:
+        return self._flock
+
+    def _load_if_changed(self):
+        try:
+            st = os.stat(self.postings_path)
+        except FileNotFoundError:
+            self._reset()
+            self._loaded_stamp = None
+            return
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self._loaded_stamp:
+            return
+        with open(self.postings_path, "rb") as f:
+            state = pickle.load(f)
+        self.postings = state["postings"]
+        self.doc_lengths = state["doc_lengths"]
+        self.offsets = state["offsets"]
+        self.file_ids = state["file_ids"]
+        self.docs_ino = state.get("docs_ino")
+        self.avgdl = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        self._loaded_stamp = stamp
+
+    def _save(self):
+        tmp = self.postings_path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths,
+                "offsets": self.offsets,
+                "file_ids": self.file_ids,
+                "docs_ino": os.stat(self.docs_path).st_ino,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.postings_path)
+        self._loaded_stamp = None
+
+    def _index_docs(self, docs: List[Dict], docs_file):
+        """
+        Appends docs to docs_file and the in-memory postings.
+        """
+        for doc in docs:
+            doc_id = len(self.doc_lengths)
+            self.offsets.append(docs_file.tell())
+            docs_file.write((json.dumps(doc) + "\n").encode("utf-8"))
+            terms = Counter(tokenize(doc["content"]))
+            self.doc_lengths.append(sum(terms.values()))
+            self.file_ids.append(doc["file_id"])
+            for term, tf in terms.items():
+                entry = self.postings.get(term)
+                if entry is None:
+                    entry = self.postings[term] = (array("I"), array("H"))
+                entry[0].append(doc_id)
+                entry[1].append(min(tf, 65535))
+
+    @staticmethod
+    def _doc(row: Dict) -> Dict:
+        md = row.get("metadata") or {}
+        return {"file_id": row.get("file_id"), "content": row["content"], "source": md.get("source"), "metadata": md}
+
+    def add(self, rows: List[Dict]):
+        """
+        Indexes chunk rows (as inserted into the chunks table).
+        """
+        with self._file_lock():
+            self._load_if_changed()
+            with open(self.docs_path, "ab") as f:
+                self._index_docs([self._doc(r) for r in rows], f)
+            self._save()
+
+    def delete_files(self, file_ids: List[str]) -> int:
+        """
+        Drops the files' chunks by rebuilding the index from the remaining docs.
+        """
+        drop = set(file_ids)
+        with self._file_lock():
+            self._load_if_changed()
+            removed = sum(1 for fid in self.file_ids if fid in drop)
+            if not removed:
+                return 0
+            keep = []
+            with open(self.docs_path, "rb") as f:
+                for line in f:
+                    doc = json.loads(line)
+                    if doc["file_id"] not in drop:
+                        keep.append(doc)
+            self._reset()
+            tmp = self.docs_path + ".tmp"
+            with open(tmp, "wb") as f:
+                self._index_docs(keep, f)
+            os.replace(tmp, self.docs_path)
+            self._save()
+            return removed
+
+    def search(self, query: str, top_k: int) -> List[Dict]:
+        """
+        BM25 top-k. Each hit carries "bm25" and "lexical_coverage", the share
+        of distinct query terms found in the chunk.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            results = self._search(terms, top_k, check_docs=True)
+        if results is None:
+            # Another worker rewrote docs.jsonl after our postings were loaded;
+            # under the file lock the two are consistent again
+            with self._file_lock():
+                self._loaded_stamp = None
+                self._load_if_changed()
+                if self.doc_lengths and self.docs_ino is None:
+                    self._save()  # written before the docs inode was recorded
+                results = self._search(terms, top_k, check_docs=False)
+        return results
+
+    def _search(self, terms: List[str], top_k: int, check_docs: bool) -> Optional[List[Dict]]:
+        """
+        Scores and reads the top docs. Returns None when check_docs is set and
+        docs.jsonl is not the file the loaded offsets point into. Caller holds
+        the lock; docs are read from a handle opened under it, so a later
+        rewrite cannot move them.
+        """
+        self._load_if_changed()
+        n = len(self.doc_lengths)
+        if not n:
+            return []
+        lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32).astype(np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (self.avgdl or 1.0))
+        scores = np.zeros(n, dtype=np.float32)
+        matched = np.zeros(n, dtype=np.int32)
+        for term in terms:
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            ids = np.frombuffer(entry[0], dtype=np.uint32)
+            tfs = np.frombuffer(entry[1], dtype=np.uint16).astype(np.float32)
+            df = len(ids)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[ids])
+            matched[ids] += 1
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        k = min(top_k, len(hits))
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        with open(self.docs_path, "rb") as f:
+            if check_docs and os.fstat(f.fileno()).st_ino != self.docs_ino:
+                return None
+            for i in top:
+                f.seek(self.offsets[i])
+                doc = json.loads(f.readline())
+                doc["bm25"] = float(scores[i])
+                doc["lexical_coverage"] = float(matched[i]) / len(terms)
+                results.append(doc)
+        return results
+
+
+class LexicalIndexStore:
+    """
+    Lazily opened per-user lexical indexes, least recently used dropped from memory.
+    """
+
+    def __init__(self, root: str = LEXICAL_INDEX_DIR, max_users: int = LEXICAL_INDEX_MAX_USERS):
+        self.root = root
+        self.max_users = max_users
+        self._indexes: "OrderedDict[str, LexicalIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> LexicalIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = LexicalIndex(os.path.join(self.root, re.sub(r"[^A-Za-z0-9_.-]", "_", user_id)))
+                self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+            return index
+
+    def _backfill(self, user_id: str, index: LexicalIndex, loader) -> bool:
+        if index.exists() or loader is None:
+            return False
+        with index._file_lock():
+            if index.exists():
+                return False
+            index.add(loader(user_id))
+            return True
+
+    def add(self, user_id: str, rows: List[Dict], loader=None):
+        index = self.get(user_id)
+        if not self._backfill(user_id, index, loader):
+            index.add(rows)
+
+    def delete_files(self, user_id: str, file_ids: List[str]) -> int:
+        index = self.get(user_id)
+        return index.delete_files(file_ids) if index.exists() else 0
+
+    def search(self, user_id: str, query: str, top_k: int, loader=None) -> List[Dict]:
+        index = self.get(user_id)
+        self._backfill(user_id, index, loader)
+        return index.search(query, top_k)
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], key, k: int = 60, weights: List[float] = None) -> List[Dict]:
+    """
+    Merges ranked lists; an item's score is sum(weight / (k + rank)).
+    The first occurrence of each item (by key) is kept, annotated with "rrf_score".
+    """
+    weights = weights or [1.0] * len(result_lists)
+    merged: Dict[str, Dict] = {}
+    scores: Dict[str, float] = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, item in enumerate(results):
+            item_key = key(item)
+            scores[item_key] = scores.get(item_key, 0.0) + weight / (k + rank + 1)
+            if item_key in merged:
+                merged[item_key] = {**item, **merged[item_key]}
+            else:
+                merged[item_key] = dict(item)
+    ordered = sorted(merged, key=lambda item_key: -scores[item_key])
+    return [{**merged[item_key], "rrf_score": scores[item_key]} for item_key in ordered]
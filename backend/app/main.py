@@ -1,21 +1,52 @@
 #  CHECKPOINT WORKING Fully functional
 # app/main.py
+import os
+import json
+import asyncio
+import base64
+import hashlib
+import tempfile
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
-from fastapi import FastAPI, Request, File, UploadFile, HTTPException, Depends
-from typing import List, Set
+from fastapi import FastAPI, Request, Response, File, UploadFile, HTTPException, Depends
+from typing import List, Optional, Set
 from pydantic import BaseModel
 
 from .db import supabase
-from .ingest import process_document
-from .retrieval import retrieve_chunks
-from .query_llm import ask_gemini, generate_clarification
-from .schemas import AskRequest, AskResponse, ChunkUsed, Source
+from .jobs import submit_ingest_job, get_job, QueueFullError
+from .retrieval import aretrieve_chunks, aretrieve_many, aembed_query, embedding_cache, embedding_flight, remove_files
+from .response_cache import response_cache
+from .corpus import corpus_version, bump_corpus_version, VERSION_SCOPE, CORPUS_VERSION_PATH
+from .ambiguity import assess, clarification_question, clarifications, CLARIFY_WITH_LLM
+from .query_llm import aask_gemini, astream_gemini, agenerate_clarification, generation_flight, stream_flight
+from .upstream import supabase_upstream
+from .quota import current_priority, BACKGROUND
+from .schemas import AskRequest, AskBatchRequest, AskResponse, ChunkUsed, Source
 from .utils import unique_sources
+from .memory import session_store, merge_chunks, SESSION_STORE_PATH
+from .prompt import pack_context, build_user_prompt
+from . import metrics
+from .metrics import span, start_trace, trace_ms
+from .auth import verified_tokens
 from .auth import auth_router, get_current_user
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.encoders import jsonable_encoder
 
-SIMILARITY_THRESHOLD = 0.25
+# Uploads are streamed to disk in blocks, never held in memory whole
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or tempfile.gettempdir()
+# Questions per /ask/batch request, and how many of them generate at once
+ASK_BATCH_MAX_QUESTIONS = int(os.getenv("ASK_BATCH_MAX_QUESTIONS", "200"))
+ASK_BATCH_CONCURRENCY = int(os.getenv("ASK_BATCH_CONCURRENCY", "8"))
+# GET /files paging and the columns it may return
+FILES_PAGE_SIZE = int(os.getenv("FILES_PAGE_SIZE", "100"))
+FILES_MAX_PAGE_SIZE = 1000
+FILE_LIST_COLUMNS = ("file_id", "filename", "uploaded_at", "storage_path")
+FILE_LIST_DEFAULT_COLUMNS = ("file_id", "filename", "uploaded_at")
+# File ids per DELETE statement (they all go into the request URL)
+FILE_DELETE_BATCH_SIZE = 200
 
 app = FastAPI(title="Campus Knowledge Agent API")
 app.include_router(auth_router)
@@ -28,58 +59,267 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# per-user in-memory follow-up context
-session_memory = {}
+# With a *_PATH setting these stores are SQLite files, kept off the event loop
+_SQLITE_STORES = bool(CORPUS_VERSION_PATH or SESSION_STORE_PATH or response_cache.store.shared is not None)
 
-@app.post("/ask", response_model=AskResponse)
-async def ask(req: AskRequest, user=Depends(get_current_user)):
-    user_id = user["user_id"]
-    previous_context = session_memory.get(user_id, {})
+async def _store(fn, *args):
+    """
+    Calls a corpus version, response cache or session store function:
+    inline while they are all in memory, else on the supabase executor.
+    """
+    if not _SQLITE_STORES:
+        return fn(*args)
+    return await supabase_upstream.run(fn, *args)
+
+async def _plan_answer(req: AskRequest, user_id: str, query_embedding: list = None,
+                       retrieved: tuple = None, session: bool = True):
+    """
+    Runs retrieval and decides how to answer. Returns (response, None) when
+    the request can be answered without generation, else (None, plan).
 
-    chunks, raw_context = retrieve_chunks(req.question, user_id=user_id, top_k=req.top_k)
+    Batch callers pass the query embedding and (chunks, raw_context) they
+    already retrieved, and session=False to leave conversation memory alone.
+    """
+    trace = start_trace() if req.debug else None
+    version = await _store(corpus_version, user_id)
+    # Follow-up context: chunks of the last few turns, deduplicated
+    previous_context = await _store(session_store.context_chunks, user_id) if session else []
 
-    combined_context = (previous_context.get("raw_context", "") + "\n\n" + raw_context).strip() if previous_context else raw_context
+    # Follow-ups depend on the conversation, so they skip the response cache
+    cached, cache_status = None, "bypass"
+    if not previous_context:
+        with span("response_cache"):
+            cached = await _store(response_cache.get_exact, user_id, req.question, version, req.top_k)
+        cache_status = "hit"
+        if cached is None:
+            if query_embedding is None:
+                query_embedding = await aembed_query(req.question)
+            with span("response_cache"):
+                cached = await _store(response_cache.get_similar, user_id, query_embedding, version, req.top_k)
+            cache_status = "semantic_hit" if cached is not None else "miss"
+    if cached is not None:
+        response = AskResponse(**{**cached, "question": req.question})
+        if session:
+            # Still a turn of the conversation, so follow-ups can refer to it
+            await _store(session_store.add_turn, user_id, req.question, _cached_chunks(response))
+        if req.debug:
+            response.debug_info = {"response_cache": cache_status, "corpus_version": version,
+                                   "stages_ms": trace_ms(trace)}
+        return response, None
 
+    if retrieved is None:
+        with span("retrieve"):
+            retrieved = await aretrieve_chunks(req.question, user_id=user_id, top_k=req.top_k)
+    chunks, raw_context = retrieved
+
+    debug_info = {"response_cache": cache_status, "corpus_version": version, "stages_ms": trace_ms(trace)} \
+        if req.debug else None
     if not chunks and not previous_context:
         return AskResponse(
             question=req.question,
             answer="I don't know based on the provided documents.",
             sources=[],
-            chunks_used=[]
-        )
+            chunks_used=[],
+            debug_info=debug_info
+        ), None
 
-    top_similarity = max([c.get("similarity", 0) for c in chunks], default=0)
-    if top_similarity < SIMILARITY_THRESHOLD and not previous_context:
-        clarification = generate_clarification(req.question, combined_context)
+    # Decided from the retrieval scores; no extra Gemini call unless CLARIFY_WITH_LLM
+    ambiguity = assess(chunks, req.question)
+    if debug_info:
+        debug_info["ambiguity"] = ambiguity
+    if ambiguity["ambiguous"] and not previous_context:
+        clarifications.inc(reason=ambiguity["reason"])
+        if CLARIFY_WITH_LLM:
+            clarification = await agenerate_clarification(req.question, raw_context)
+        else:
+            clarification = clarification_question(req.question, ambiguity)
+        if debug_info:
+            debug_info["stages_ms"] = trace_ms(trace)
         return AskResponse(
             question=req.question,
             answer=None,
             sources=[],
             chunks_used=[],
             clarification_required=True,
-            clarification_question=clarification
-        )
+            clarification_question=clarification,
+            clarification_options=[Source(**o) for o in ambiguity["options"]],
+            debug_info=debug_info
+        ), None
 
-    answer = ask_gemini(combined_context + "\n\nQuestion: " + req.question)
+    # Only what fits the token budget is sent, numbered for [S#] citations
+    with span("context_pack"):
+        packed, context_block, context_report = pack_context(merge_chunks(chunks, previous_context))
 
-    # Save session context per user
-    session_memory[user_id] = {
-        "question": req.question,
+    return None, {
+        "embedding": query_embedding,
+        "corpus_version": version,
         "chunks": chunks,
-        "raw_context": combined_context
+        "context_chunks": packed,
+        "context_report": context_report,
+        "trace": trace,
+        "session": session,
+        "cache_status": cache_status,
+        "prompt": build_user_prompt(req.question, context_block),
     }
 
+def _cached_chunks(response: AskResponse) -> List[dict]:
+    """
+    Chunk dicts for the session store, rebuilt from a cached answer's chunks_used.
+    """
+    return [{"content": c.text, "source": c.source, "page": c.page, "similarity": c.similarity,
+             "metadata": {"page_number": c.page}} for c in response.chunks_used]
+
+def _sources_and_chunks(chunks: List[dict]):
     sources = [Source(**s) for s in unique_sources(chunks)]
     used = [ChunkUsed(
         text=c["content"], source=c.get("source"), page=c.get("page"), similarity=c.get("similarity")
     ) for c in chunks]
+    return sources, used
 
-    return AskResponse(
+async def _finish_answer(req: AskRequest, user_id: str, plan: dict, answer: str) -> AskResponse:
+    # Save session context per user
+    if plan["session"]:
+        await _store(session_store.add_turn, user_id, req.question, plan["chunks"])
+
+    sources, used = _sources_and_chunks(plan["context_chunks"])
+    response = AskResponse(
         question=req.question,
         answer=answer.strip(),
         sources=sources,
         chunks_used=used
     )
+    if plan["cache_status"] != "bypass" and not answer.startswith("Error:"):
+        await _store(response_cache.set, user_id, req.question, plan["embedding"], jsonable_encoder(response),
+                     plan["corpus_version"], req.top_k)
+    if req.debug:
+        response.debug_info = {
+            "response_cache": plan["cache_status"],
+            "corpus_version": plan["corpus_version"],
+            "context": plan["context_report"],
+            "stages_ms": trace_ms(plan["trace"]),
+        }
+    return response
+
+@app.post("/ask", response_model=AskResponse)
+async def ask(req: AskRequest, user=Depends(get_current_user)):
+    user_id = user["user_id"]
+    with span("ask"):
+        response, plan = await _plan_answer(req, user_id)
+        if response:
+            return response
+
+        answer = await aask_gemini(plan["prompt"])
+        return await _finish_answer(req, user_id, plan, answer)
+
+def _frame(data: dict) -> bytes:
+    return (json.dumps(jsonable_encoder(data)) + "\n").encode()
+
+@app.post("/ask/stream")
+async def ask_stream(req: AskRequest, user=Depends(get_current_user)):
+    """
+    Streams the answer as NDJSON frames: one "sources" frame, then "token"
+    frames as the model generates, then a "done" frame with the full AskResponse.
+    """
+    user_id = user["user_id"]
+
+    async def frames():
+        response, plan = await _plan_answer(req, user_id)
+        if response:
+            yield _frame({"type": "sources", "sources": response.sources, "chunks_used": response.chunks_used})
+            if response.answer:
+                yield _frame({"type": "token", "text": response.answer})
+            yield _frame({"type": "done", **jsonable_encoder(response)})
+            return
+
+        sources, used = _sources_and_chunks(plan["context_chunks"])
+        yield _frame({
+            "type": "sources",
+            "sources": sources,
+            "chunks_used": used,
+        })
+
+        parts = []
+        async for text in astream_gemini(plan["prompt"]):
+            parts.append(text)
+            yield _frame({"type": "token", "text": text})
+
+        response = await _finish_answer(req, user_id, plan, "".join(parts))
+        yield _frame({"type": "done", **jsonable_encoder(response)})
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+@app.post("/ask/batch")
+async def ask_batch(req: AskBatchRequest, user=Depends(get_current_user)):
+    """
+    Answers a question set as NDJSON: one "answer" frame per question, in
+    the order they finish, with its index in req.questions and the full
+    AskResponse, then a "done" frame. All questions are embedded in one
+    batched call and searched together; at most ASK_BATCH_CONCURRENCY
+    generate at a time. If that shared retrieval fails, an "error" frame
+    is sent instead of the answers, and "done" counts every question as
+    failed.
+    """
+    if len(req.questions) > ASK_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {ASK_BATCH_MAX_QUESTIONS} questions per batch")
+    user_id = user["user_id"]
+
+    async def frames():
+        # Question sets queue for Gemini quota behind interactive questions
+        current_priority.set(BACKGROUND)
+        try:
+            with span("retrieve"):
+                embeddings, results = await aretrieve_many(req.questions, user_id=user_id, top_k=req.top_k)
+        except Exception as e:
+            yield _frame({"type": "error", "error": f"Error: {e}"})
+            yield _frame({"type": "done", "count": len(req.questions), "errors": len(req.questions)})
+            return
+        limit = asyncio.Semaphore(ASK_BATCH_CONCURRENCY)
+
+        async def answer(i: int):
+            one = AskRequest(question=req.questions[i], top_k=req.top_k, debug=req.debug)
+            async with limit:
+                try:
+                    response, plan = await _plan_answer(one, user_id, query_embedding=embeddings[i],
+                                                        retrieved=results[i], session=False)
+                    if plan:
+                        response = await _finish_answer(one, user_id, plan, await aask_gemini(plan["prompt"]))
+                except Exception as e:
+                    response = AskResponse(question=one.question, answer=f"Error: {e}")
+            return i, response
+
+        failed = 0
+        for done in asyncio.as_completed([answer(i) for i in range(len(req.questions))]):
+            i, response = await done
+            failed += (response.answer or "").startswith("Error:")
+            yield _frame({"type": "answer", "index": i, **jsonable_encoder(response)})
+        yield _frame({"type": "done", "count": len(req.questions), "errors": failed})
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+async def _save_upload(file: UploadFile) -> str:
+    """
+    Copies the upload to a unique temp file in UPLOAD_BLOCK_SIZE blocks.
+    Raises 413 (and removes the partial file) past UPLOAD_MAX_BYTES.
+    """
+    fd, temp_path = tempfile.mkstemp(prefix="upload_", suffix=".pdf", dir=UPLOAD_DIR)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = await file.read(UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB."
+                    )
+                f.write(block)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path
 
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...), user=Depends(get_current_user)):
@@ -88,35 +328,112 @@ async def upload_file(file: UploadFile = File(...), user=Depends(get_current_use
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
 
-    temp_path = f"temp_{file.filename}"
-    with open(temp_path, "wb") as f:
-        f.write(await file.read())
+    temp_path = await _save_upload(file)
+    # Until the ingestion job takes it over, the temp file is ours to remove
+    try:
+        # Earlier uploads under the same name are diffed against and replaced
+        previous = await supabase_upstream.run(
+            supabase.table("files").select("file_id").eq("user_id", user_id).eq("filename", file.filename).execute
+        )
+        previous_file_ids = [row["file_id"] for row in previous.data or []]
+
+        # Insert into files table first
+        resp = await supabase_upstream.run(supabase.table("files").insert({
+            "user_id": user_id,
+            "filename": file.filename,
+            "storage_path": temp_path
+        }).execute)
 
-    # Insert into files table first
-    resp = supabase.table("files").insert({
-        "user_id": user_id,
-        "filename": file.filename,
-        "storage_path": temp_path
-    }).execute()
+        if not resp.data:
+            raise HTTPException(status_code=500, detail="Could not create file record.")
+        file_id = resp.data[0]["file_id"]
+        # The file listing changed, and its ETag follows the corpus version
+        await _store(bump_corpus_version, user_id)
 
-    if not resp.data:
-        raise HTTPException(status_code=500, detail="Could not create file record.")
-    file_id = resp.data[0]["file_id"]
+        # Parsing, embedding and insertion run on the ingestion worker pool
+        try:
+            job_id = submit_ingest_job(
+                temp_path, user_id=user_id, file_id=file_id, filename=file.filename,
+                previous_file_ids=previous_file_ids
+            )
+        except QueueFullError as e:
+            await supabase_upstream.run(supabase.table("files").delete().eq("file_id", file_id).execute)
+            await _store(bump_corpus_version, user_id)
+            raise HTTPException(status_code=503, detail=str(e))
+    except BaseException:
+        os.remove(temp_path)
+        raise
 
-    try:
-        process_document(temp_path, user_id=user_id, file_id=file_id)
-    except Exception as e:
-        # cleanup if chunks fail
-        supabase.table("files").delete().eq("file_id", file_id).execute()
-        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+    return {"job_id": job_id, "file_id": file_id, "filename": file.filename, "status": "queued"}
 
-    return {"file_id": file_id, "filename": file.filename, "status": "Processed and stored successfully."}
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str, user=Depends(get_current_user)):
+    job = get_job(job_id, user["user_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {
+        "job_id": job["job_id"],
+        "file_id": job["file_id"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "chunks_done": job["chunks_done"],
+        "chunks_total": job["chunks_total"],
+        "pages_done": job["pages_done"],
+        "pages_total": job["pages_total"],
+        "error": job["error"],
+        "stats": job["stats"],
+    }
+
+def _encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["uploaded_at"], row["file_id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        uploaded_at, file_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(uploaded_at), str(file_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
 @app.get("/files")
-def list_uploaded_files(user=Depends(get_current_user)):
+def list_uploaded_files(request: Request, cursor: Optional[str] = None, limit: int = FILES_PAGE_SIZE,
+                        fields: Optional[str] = None, user=Depends(get_current_user)):
+    """
+    Lists the user's files, newest first, FILES_PAGE_SIZE at a time: pass
+    the returned next_cursor to get the following page. fields is a
+    comma-separated subset of FILE_LIST_COLUMNS.
+
+    The listing only changes when the corpus version does, so the ETag is
+    derived from it and a matching If-None-Match is answered with 304
+    without querying Supabase. Without CORPUS_VERSION_PATH the ETag is
+    also scoped to this process, since its versions are not shared.
+    """
     user_id = user["user_id"]
-    resp = supabase.table("files").select("*").eq("user_id", user_id).execute()
-    return {"files": resp.data or []}
+    limit = max(1, min(limit, FILES_MAX_PAGE_SIZE))
+    columns = [c.strip() for c in (fields or ",".join(FILE_LIST_DEFAULT_COLUMNS)).split(",") if c.strip()]
+    unknown = [c for c in columns if c not in FILE_LIST_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # Paging needs the sort key, whatever was asked for
+    columns = list(dict.fromkeys(columns + ["uploaded_at", "file_id"]))
+
+    # The user is part of the key: versions are per user, so they collide across users
+    page_key = hashlib.sha1(f"{user_id}|{cursor}|{limit}|{','.join(columns)}".encode()).hexdigest()[:16]
+    etag = f'W/"files-{VERSION_SCOPE}-{corpus_version(user_id)}-{page_key}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    query = supabase.table("files").select(", ".join(columns)).eq("user_id", user_id)
+    if cursor:
+        uploaded_at, file_id = _decode_cursor(cursor)
+        query = query.or_(
+            f'uploaded_at.lt."{uploaded_at}",and(uploaded_at.eq."{uploaded_at}",file_id.lt."{file_id}")'
+        )
+    resp = query.order("uploaded_at", desc=True).order("file_id", desc=True).limit(limit + 1).execute()
+    rows = resp.data or []
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return JSONResponse({"files": rows[:limit], "next_cursor": next_cursor}, headers=headers)
 
 
 class DeleteRequest(BaseModel):
@@ -124,18 +441,65 @@ class DeleteRequest(BaseModel):
 
 @app.delete("/files")
 def delete_files(req: DeleteRequest, user=Depends(get_current_user)):
+    """
+    Deletes the user's files and their chunks with set-based deletes
+    (two per FILE_DELETE_BATCH_SIZE ids), then drops every cache and
+    index entry derived from them.
+    """
     user_id = user["user_id"]
+    file_ids = list(dict.fromkeys(req.file_ids))
 
-    deleted, errors = [], []
-    for fid in req.file_ids:
-        resp = supabase.table("files").delete().eq("file_id", fid).eq("user_id", user_id).execute()
-        if resp.data:
-            deleted.append(fid)
-        else:
-            errors.append({"file_id": fid, "error": "Not found or not owned by user"})
+    deleted = []
+    for start in range(0, len(file_ids), FILE_DELETE_BATCH_SIZE):
+        batch = file_ids[start:start + FILE_DELETE_BATCH_SIZE]
+        # Chunks first, so a failure never leaves chunks without their file row
+        supabase.table("chunks").delete().eq("user_id", user_id).in_("file_id", batch).execute()
+        resp = supabase.table("files").delete().eq("user_id", user_id).in_("file_id", batch).execute()
+        deleted.extend(row["file_id"] for row in resp.data or [])
+
+    found = set(deleted)
+    errors = [
+        {"file_id": fid, "error": "Not found or not owned by user"}
+        for fid in file_ids if fid not in found
+    ]
+
+    if deleted:
+        remove_files(user_id, deleted)
+        bump_corpus_version(user_id)
+        response_cache.invalidate_user(user_id)
+        # Follow-up context may quote the deleted files
+        session_store.clear(user_id)
 
     return {"deleted": deleted, "errors": errors}
 
+@app.get("/cache/stats")
+def cache_stats(user=Depends(get_current_user)):
+    return {
+        "query_embeddings": embedding_cache.stats(),
+        "responses": response_cache.stats(),
+        "sessions": session_store.stats(),
+        "singleflight": {
+            flight.name: flight.stats() for flight in (embedding_flight, generation_flight, stream_flight)
+        },
+    }
+
+def _hit_rates() -> dict:
+    return {
+        (("cache", "query_embeddings"),): embedding_cache.stats()["hit_rate"],
+        (("cache", "responses"),): response_cache.stats()["hit_rate"],
+        (("cache", "verified_tokens"),): verified_tokens.stats()["hit_rate"],
+    }
+
+metrics.register_gauge("rag_cache_hit_rate", "Hit rate of each cache since start.", _hit_rates)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Prometheus text exposition: stage latencies, LLM tokens, upstream
+    errors and cache hit rates of this worker.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/me")
 def me(user=Depends(get_current_user)):
     return user
@@ -1,11 +1,108 @@
 # app/memory.py
 #  CHECKPOINT WORKING Fully functional
-from typing import Dict, List
-from .schemas import AskRequest, AskResponse
+import hashlib
+import os
+from typing import Dict, List, Optional
 
-# Temporary in-memory store for conversation sessions
-# session_id -> List[AskResponse]
-conversation_memory: Dict[str, List[AskResponse]] = {}
+from .cache import TTLCache, SQLiteCache
+from .schemas import AskResponse
+
+# Sessions kept in memory; least recently used ones are evicted past this
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "10000"))
+# Sessions idle for longer than this are dropped
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+# Follow-up context covers the chunks of at most this many previous turns
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "3"))
+# Hard cap on distinct chunks carried between turns
+SESSION_MAX_CHUNKS = int(os.getenv("SESSION_MAX_CHUNKS", "12"))
+# Set this (to the same file in every worker) so all workers share sessions
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "")
+SESSION_STORE_MAX_ROWS = int(os.getenv("SESSION_STORE_MAX_ROWS", "100000"))
+
+
+def chunk_id(chunk: Dict) -> str:
+    """
+    Stable id of a retrieved chunk: file_id (the source name only if that
+    is missing) and content hash or chunk index when known, else a hash of
+    its text.
+    """
+    md = chunk.get("metadata") or {}
+    owner = md.get("file_id") or chunk.get("file_id") or chunk.get("source")
+    if owner and md.get("content_hash"):
+        return f"{owner}:{md['content_hash']}"
+    if owner and md.get("chunk_index") is not None:
+        return f"{owner}:{md['chunk_index']}"
+    return hashlib.sha1(chunk["content"].encode("utf-8")).hexdigest()
+
+
+def merge_chunks(*chunk_lists: List[Dict]) -> List[Dict]:
+    """
+    Concatenates chunk lists, keeping the first occurrence of each chunk id.
+    """
+    seen, merged = set(), []
+    for chunks in chunk_lists:
+        for chunk in chunks:
+            cid = chunk_id(chunk)
+            if cid not in seen:
+                seen.add(cid)
+                merged.append(chunk)
+    return merged
+
+
+class SessionStore:
+    """
+    Per-user follow-up context: the questions and retrieved chunks of the
+    last few turns, deduplicated by chunk id.
+
+    In-process LRU with an idle TTL by default; with SESSION_STORE_PATH
+    sessions live only in SQLite so every worker sees the latest turn.
+    """
+
+    def __init__(self, path: str = SESSION_STORE_PATH, max_users: int = SESSION_MAX_USERS,
+                 ttl: float = SESSION_IDLE_TTL, max_turns: int = SESSION_MAX_TURNS,
+                 max_chunks: int = SESSION_MAX_CHUNKS):
+        self.max_turns = max_turns
+        self.max_chunks = max_chunks
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.store = SQLiteCache(path, table="sessions", max_rows=SESSION_STORE_MAX_ROWS, ttl=ttl)
+        else:
+            self.store = TTLCache(maxsize=max_users, ttl=ttl)
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        """
+        {"turns": [{"question", "chunk_ids"}], "chunks": [...]} or None.
+        """
+        return self.store.get(user_id)
+
+    def context_chunks(self, user_id: str) -> List[Dict]:
+        session = self.get(user_id)
+        return session["chunks"] if session else []
+
+    def add_turn(self, user_id: str, question: str, chunks: List[Dict]):
+        """
+        Records a turn. Only chunks referenced by the kept turns survive,
+        newest first, up to max_chunks.
+        """
+        session = self.get(user_id) or {"turns": [], "chunks": []}
+        turns = (session["turns"] + [{"question": question, "chunk_ids": [chunk_id(c) for c in chunks]}])
+        turns = turns[-self.max_turns:]
+        live = {cid for turn in turns for cid in turn["chunk_ids"]}
+        merged = [c for c in merge_chunks(chunks, session["chunks"]) if chunk_id(c) in live]
+        self.store.set(user_id, {"turns": turns, "chunks": merged[:self.max_chunks]})
+
+    def clear(self, user_id: str):
+        self.store.delete(user_id)
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+session_store = SessionStore()
+
+# session_id -> List[AskResponse], bounded like the session store
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "50"))
+conversation_memory = TTLCache(maxsize=SESSION_MAX_USERS, ttl=SESSION_IDLE_TTL)
 
 
 def get_history(session_id: str) -> List[AskResponse]:
@@ -14,7 +111,6 @@ def get_history(session_id: str) -> List[AskResponse]:
 
 
 def add_to_history(session_id: str, response: AskResponse):
-    """Append a new response to session memory"""
-    if session_id not in conversation_memory:
-        conversation_memory[session_id] = []
-    conversation_memory[session_id].append(response)
+    """Append a new response to session memory, keeping the latest messages"""
+    history = get_history(session_id) + [response]
+    conversation_memory.set(session_id, history[-CONVERSATION_MAX_MESSAGES:])
@@ -0,0 +1,148 @@
+# app/metrics.py
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Upper bounds in seconds, from cache hits to slow LLM calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Every Histogram and Counter created, in creation order, for render()
+_registry: list = []
+
+# Stage -> seconds for the request being handled, when it asked for a trace
+_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar("trace", default=None)
+
+
+def _labels_text(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram with one series per label set.
+    """
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels_text(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels_text(key)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        lines.extend(f"{self.name}{_labels_text(key)} {value}" for key, value in items)
+        return lines
+
+
+stage_seconds = Histogram("rag_stage_seconds", "Latency of each RAG pipeline stage.")
+llm_tokens = Counter("rag_llm_tokens_total", "LLM tokens by direction (in = prompt, out = answer).")
+upstream_errors = Counter("rag_upstream_errors_total", "Failed calls to upstream services.")
+
+# name -> (help, fn() -> {labels tuple: value}), read at scrape time
+_gauges: Dict[str, Tuple[str, Callable[[], Dict[Tuple, float]]]] = {}
+
+
+def register_gauge(name: str, help: str, fn: Callable[[], Dict[Tuple, float]]):
+    _gauges[name] = (help, fn)
+
+
+def observe_stage(stage: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    stage_seconds.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def _span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - t0)
+
+
+@contextmanager
+def _noop_span(stage: str):
+    yield
+
+
+# Disabled metrics skip even the clock reads
+span = _span if METRICS_ENABLED else _noop_span
+
+
+def start_trace() -> Dict[str, float]:
+    """
+    Collects the stages of the current request (and of the executor
+    calls it makes through Upstream.run) into the returned dict.
+    """
+    trace: Dict[str, float] = {}
+    _trace.set(trace)
+    return trace
+
+
+def trace_ms(trace: Dict[str, float]) -> Dict[str, float]:
+    return {stage: round(seconds * 1000, 2) for stage, seconds in trace.items()}
+
+
+def render() -> str:
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    for name, (help, fn) in list(_gauges.items()):
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge"])
+        lines.extend(f"{name}{_labels_text(key)} {value}" for key, value in fn().items())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,76 @@
+# app/pdf_extract.py
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from pypdf import PdfReader
+
+# Processes used to extract text from large PDFs (0 or 1 disables the pool)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# Smaller documents are extracted in the calling process
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+# Pages handed to a worker at a time
+PDF_SHARD_PAGES = int(os.getenv("PDF_SHARD_PAGES", "16"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the API process is multi-threaded
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def page_count(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+
+def extract_range(file_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """
+    [(page_number, text)] for pages start..stop-1 (0-based, like PyPDFLoader).
+    Runs inside pool workers, so it opens its own reader.
+    """
+    reader = PdfReader(file_path)
+    return [(i, reader.pages[i].extract_text()) for i in range(start, min(stop, len(reader.pages)))]
+
+
+def iter_pages(file_path: str, pages: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Yields (page_number, text) in page order. Documents with at least
+    PDF_PARALLEL_MIN_PAGES pages are extracted in PDF_SHARD_PAGES shards on
+    the process pool, with a bounded number of shards in flight so memory
+    stays flat however long the document is.
+    """
+    pages = page_count(file_path) if pages is None else pages
+    if PDF_EXTRACT_WORKERS <= 1 or pages < PDF_PARALLEL_MIN_PAGES:
+        reader = PdfReader(file_path)
+        for i, page in enumerate(reader.pages):
+            yield i, page.extract_text()
+        return
+
+    pool = _get_pool()
+    shards = iter(range(0, pages, PDF_SHARD_PAGES))
+    in_flight = []
+    for start in shards:
+        in_flight.append(pool.submit(extract_range, file_path, start, start + PDF_SHARD_PAGES))
+        if len(in_flight) >= 2 * PDF_EXTRACT_WORKERS:
+            break
+    try:
+        while in_flight:
+            shard = in_flight.pop(0).result()
+            start = next(shards, None)
+            if start is not None:
+                in_flight.append(pool.submit(extract_range, file_path, start, start + PDF_SHARD_PAGES))
+            yield from shard
+    finally:
+        for future in in_flight:
+            future.cancel()
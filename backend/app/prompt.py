@@ -1,7 +1,16 @@
 # app/prompt.py
 #  CHECKPOINT WORKING Fully functional
+import os
+import re
 from typing import List, Dict
 
+# Approximate prompt tokens allowed for the CONTEXT block
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Share of a chunk's word trigrams already in the context above which it is dropped
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+# Shortest shared prefix/suffix worth trimming from overlapping neighbours
+CONTEXT_MIN_OVERLAP = 20
+
 SYSTEM_INSTRUCTION = (
     "You are a campus knowledge assistant. "
     "Answer ONLY using the provided CONTEXT. "
@@ -34,3 +43,79 @@ def build_user_prompt(question: str, context_block: str) -> str:
         f"- Be concise and factually correct.\n"
         f"- Include citations [S#] after each claim you take from context.\n"
     )
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (~4 characters per token for English text).
+    """
+    return (len(text) + 3) // 4
+
+
+def _trigrams(text: str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+
+
+def _overlap(head: str, tail: str) -> int:
+    """
+    Length of the longest suffix of head that is a prefix of tail.
+    """
+    for n in range(min(len(head), len(tail)), CONTEXT_MIN_OVERLAP - 1, -1):
+        if head.endswith(tail[:n]):
+            return n
+    return 0
+
+
+def _score(chunk: Dict) -> float:
+    score = chunk.get("score")
+    if score is None:
+        score = chunk.get("similarity")
+    return score or 0.0
+
+
+def pack_context(chunks: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    chunks: retrieval results (content, source, page, similarity/score)
+    Orders chunks by score, drops near-duplicates, trims text repeated from
+    an already packed chunk (splitter overlap) and stops at the token budget.
+    Returns (packed chunks, numbered context block, report); packed chunk i
+    is cited as [S{i+1}].
+    """
+    packed, seen, texts = [], set(), []
+    duplicates = 0
+    used = 0
+    for chunk in sorted(chunks, key=_score, reverse=True):
+        text = chunk["content"].strip()
+        grams = _trigrams(text)
+        if grams and len(grams & seen) / len(grams) >= CONTEXT_DUPLICATE_THRESHOLD:
+            duplicates += 1
+            continue
+        for other in texts:
+            text = text[_overlap(other, text):].lstrip()
+            cut = _overlap(text, other)
+            if cut:
+                text = text[:-cut].rstrip()
+        if not text:
+            duplicates += 1
+            continue
+        cost = estimate_tokens(text) + 10  # header line
+        if used + cost > budget:
+            continue
+        used += cost
+        seen |= grams
+        texts.append(text)
+        packed.append({**chunk, "text": text})
+
+    block = build_context_block(packed)
+    tokens_in = sum(estimate_tokens(c["content"]) + 10 for c in chunks)
+    report = {
+        "chunks_in": len(chunks),
+        "chunks_packed": len(packed),
+        "duplicates_dropped": duplicates,
+        "tokens_in": tokens_in,
+        "tokens_packed": estimate_tokens(block),
+        "tokens_saved": max(tokens_in - estimate_tokens(block), 0),
+        "budget": budget,
+    }
+    return packed, block, report
@@ -0,0 +1,176 @@
+# app/quantized_index.py
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from .vector_index import UserVectorIndex, _normalize, SEARCH_QUERY_BLOCK
+
+# Candidates re-ranked with the exact vectors, as a multiple of top_k
+QUANT_RERANK_FACTOR = int(os.getenv("QUANT_RERANK_FACTOR", "4"))
+
+_SCAN_BLOCK = 65536
+_CODE_DTYPES = {"float16": np.float16, "int8": np.int8}
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """
+    Compact copy of unit vectors: float16, or int8 with one scale per
+    vector (x ~= code * scale). Returns (codes, scales); scales is None
+    for float16.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.empty(0, dtype=np.float32)
+    scales = scales.astype(np.float32)
+    safe = np.where(scales == 0, 1.0, scales)[:, None]
+    return np.clip(np.rint(vectors / safe), -127, 127).astype(np.int8), scales
+
+
+class QuantizedVectorIndex(UserVectorIndex):
+    """
+    UserVectorIndex that scans a compact copy of the matrix and re-ranks
+    the best top_k * QUANT_RERANK_FACTOR candidates against the exact
+    float32 rows, so only those rows of vectors.f32 are read per query.
+
+    Extra files:
+      vectors.f16 / vectors.i8 - compact rows, appended alongside vectors.f32
+      scales.f32               - int8 only: per-row scale
+      codes.json               - {"dtype", "vectors_ino"}: the vectors.f32 the codes were built from
+    """
+
+    def __init__(self, path: str, dtype: str = "int8", rerank_factor: int = QUANT_RERANK_FACTOR):
+        if dtype not in _CODE_DTYPES:
+            raise ValueError(f"unsupported quantization {dtype!r}, expected float16 or int8")
+        self.code_dtype = dtype
+        self.rerank_factor = rerank_factor
+        self.codes_path = os.path.join(path, "vectors.f16" if dtype == "float16" else "vectors.i8")
+        self.scales_path = os.path.join(path, "scales.f32")
+        self.codes_header_path = os.path.join(path, "codes.json")
+        super().__init__(path)
+
+    def _reset(self):
+        super()._reset()
+        self.codes = np.empty((0, 0), dtype=_CODE_DTYPES[self.code_dtype])
+        self.scales = None
+
+    def _stored_codes(self):
+        """
+        Codes on disk that still line up with vectors.f32, memory-mapped.
+        A rewrite of vectors.f32 (compaction) replaces its inode, which
+        invalidates codes that were not rewritten with it.
+        """
+        empty = np.empty((0, self.dim), dtype=_CODE_DTYPES[self.code_dtype])
+        try:
+            with open(self.codes_header_path, "r", encoding="utf-8") as f:
+                header = json.load(f)
+            ino = os.stat(self.vectors_path).st_ino
+            itemsize = np.dtype(_CODE_DTYPES[self.code_dtype]).itemsize
+            rows = min(self.count, os.path.getsize(self.codes_path) // (itemsize * self.dim))
+            if self.code_dtype == "int8":
+                rows = min(rows, os.path.getsize(self.scales_path) // 4)
+        except (FileNotFoundError, ValueError):
+            return empty, None
+        if header.get("dtype") != self.code_dtype or header.get("vectors_ino") != ino:
+            return empty, None
+        if not rows:
+            return empty, None
+        codes = np.memmap(self.codes_path, dtype=_CODE_DTYPES[self.code_dtype], mode="r", shape=(rows, self.dim))
+        scales = None
+        if self.code_dtype == "int8":
+            scales = np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(rows,))
+        return codes, scales
+
+    def _on_load(self):
+        if not self.count:
+            self.codes, self.scales = np.empty((0, self.dim), dtype=_CODE_DTYPES[self.code_dtype]), None
+            return
+        codes, scales = self._stored_codes()
+        if len(codes) < self.count:
+            # Rows not quantized on disk yet (a writer in progress, or a new index)
+            tail_codes, tail_scales = quantize(self.matrix[len(codes):self.count], self.code_dtype)
+            codes = np.concatenate([codes, tail_codes])
+            if self.code_dtype == "int8":
+                scales = np.concatenate([scales if scales is not None else np.empty(0, np.float32), tail_scales])
+        self.codes, self.scales = codes, scales
+
+    def _write_codes(self, start: int):
+        """
+        Appends self.codes[start:] (and scales) to disk, or rewrites the
+        files when start is 0. Caller holds the file lock.
+        """
+        arrays = [(self.codes_path, self.codes)]
+        if self.code_dtype == "int8":
+            arrays.append((self.scales_path, self.scales))
+        for path, array in arrays:
+            if start:
+                with open(path, "ab") as f:
+                    f.write(np.ascontiguousarray(array[start:]).tobytes())
+            else:
+                # Replaced, not truncated: other workers may have the old file mapped
+                with open(path + ".tmp", "wb") as f:
+                    f.write(np.ascontiguousarray(array).tobytes())
+                os.replace(path + ".tmp", path)
+        with open(self.codes_header_path, "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.code_dtype, "vectors_ino": os.stat(self.vectors_path).st_ino}, f)
+
+    def add(self, rows: List[Dict]):
+        if not rows:
+            return
+        with self._file_lock():
+            self._load_if_changed()
+            stored, _ = self._stored_codes()
+            super().add(rows)
+            self._load_if_changed()
+            # Appended when the stored codes cover every earlier row
+            self._write_codes(len(stored) if len(stored) == self.count - len(rows) else 0)
+
+    def _rewrite(self, keep: np.ndarray):
+        super()._rewrite(keep)
+        self._load_if_changed()
+        self._write_codes(0)
+
+    def _approx_scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        (rows, queries) scores from the compact codes, a block of rows at a time.
+        """
+        scores = np.empty((self.count, len(queries)), dtype=np.float32)
+        for start in range(0, self.count, _SCAN_BLOCK):
+            block = np.asarray(self.codes[start:start + _SCAN_BLOCK], dtype=np.float32) @ queries.T
+            if self.scales is not None:
+                block *= np.asarray(self.scales[start:start + _SCAN_BLOCK])[:, None]
+            scores[start:start + len(block)] = block
+        return scores
+
+    def _rerank(self, approx: np.ndarray, query: np.ndarray, top_k: int) -> List[Dict]:
+        candidates = np.sort(self._top_k(approx, top_k * self.rerank_factor))
+        exact = np.asarray(self.matrix[candidates], dtype=np.float32) @ query
+        top = self._top_k(exact, top_k)
+        return self._results(candidates[top], exact[top])
+
+    def _search(self, query_embedding: list, top_k: int) -> List[Dict]:
+        return self._search_many([query_embedding], top_k)[0]
+
+    def _search_many(self, query_embeddings: List[list], top_k: int) -> List[List[Dict]]:
+        self._load_if_changed()
+        if not self.count:
+            return [[] for _ in query_embeddings]
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+        results = []
+        for start in range(0, len(queries), SEARCH_QUERY_BLOCK):
+            block = queries[start:start + SEARCH_QUERY_BLOCK]
+            approx = self._approx_scores(block)
+            for j, query in enumerate(block):
+                results.append(self._rerank(approx[:, j], query, top_k))
+        return results
+
+    def footprint(self) -> Dict[str, int]:
+        """
+        Bytes scanned per query (the compact codes) vs. the float32 matrix.
+        """
+        with self._lock:
+            self._load_if_changed()
+            scanned = self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+            return {"rows": self.count, "float32_bytes": self.count * self.dim * 4, "scanned_bytes": int(scanned)}
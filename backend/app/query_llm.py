@@ -1,47 +1,233 @@
 import os
-import requests
+import json
+import time
+import httpx
 from dotenv import load_dotenv
+from .upstream import gemini_upstream
+from .metrics import span, observe_stage, llm_tokens, upstream_errors
+from .prompt import estimate_tokens
+from .singleflight import SingleFlight
+from .quota import quota, retry_after_seconds, backoff_seconds, QUOTA_MAX_RETRIES
 #  CHECKPOINT WORKING Fully functional
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+generation_quota = quota("generate", GEMINI_MODEL)
 
+# Connection pool tuning for the shared Gemini clients
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "10"))
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", "32"))
+GEMINI_KEEPALIVE_CONNECTIONS = int(os.getenv("GEMINI_KEEPALIVE_CONNECTIONS", "16"))
+GEMINI_KEEPALIVE_EXPIRY = float(os.getenv("GEMINI_KEEPALIVE_EXPIRY", "60"))
 
-def ask_gemini(prompt: str) -> str:
-    """
-    Calls Gemini with a raw text prompt and returns text.
-    """
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
-    payload = {
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+GEMINI_HTTP2 = HTTP2_AVAILABLE and os.getenv("GEMINI_HTTP2", "1") == "1"
+
+
+def _client_options() -> dict:
+    return {
+        "http2": GEMINI_HTTP2,
+        "timeout": httpx.Timeout(GEMINI_TIMEOUT, connect=GEMINI_CONNECT_TIMEOUT),
+        "limits": httpx.Limits(
+            max_connections=GEMINI_POOL_SIZE,
+            max_keepalive_connections=GEMINI_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=GEMINI_KEEPALIVE_EXPIRY,
+        ),
+        "headers": {"Content-Type": "application/json"},
+    }
+
+
+# Shared keep-alive clients, so each call reuses an open TCP+TLS connection
+_client = httpx.Client(**_client_options())
+_async_client = httpx.AsyncClient(**_client_options())
+
+# Identical prompts in flight at the same time share one Gemini call. The
+# prompt carries the retrieved context, so answers from different corpus
+# versions never collapse together.
+generation_flight = SingleFlight("generation")
+stream_flight = SingleFlight("generation_stream")
+
+
+def _gemini_url(method: str = "generateContent") -> str:
+    url = f"{GEMINI_BASE_URL}/models/{GEMINI_MODEL}:{method}?key={GEMINI_API_KEY}"
+    if method == "streamGenerateContent":
+        url += "&alt=sse"
+    return url
+
+
+def _gemini_payload(prompt: str) -> dict:
+    return {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {
             "temperature": 0.2,
             "maxOutputTokens": 400
         }
     }
-    headers = {"Content-Type": "application/json"}
 
-    resp = requests.post(url, json=payload, headers=headers, timeout=60)
+
+def _extract_text(resp, prompt: str = "") -> str:
     if resp.status_code != 200:
+        upstream_errors.inc(upstream="gemini")
         return f"Error: {resp.text}"
     data = resp.json()
     try:
-        return data["candidates"][0]["content"]["parts"][0]["text"]
+        text = data["candidates"][0]["content"]["parts"][0]["text"]
     except Exception:
         return str(data)
+    usage = data.get("usageMetadata") or {}
+    _count_tokens(prompt, text, usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+    return text
 
 
-def generate_clarification(query: str, context: str) -> str:
+def _count_tokens(prompt: str, answer: str, tokens_in: int = None, tokens_out: int = None):
+    # Gemini reports usage on complete responses; streamed ones are estimated
+    llm_tokens.inc(tokens_in if tokens_in is not None else estimate_tokens(prompt), direction="in")
+    llm_tokens.inc(tokens_out if tokens_out is not None else estimate_tokens(answer), direction="out")
+
+
+def _sse_text(line: str) -> str:
     """
-    Generates a clarifying question for ambiguous queries.
+    Returns the text carried by one `data: {...}` line of a
+    streamGenerateContent SSE response, or "" for other lines.
     """
-    prompt = f"""
+    if not line.startswith("data:"):
+        return ""
+    try:
+        data = json.loads(line[len("data:"):])
+        parts = data["candidates"][0]["content"]["parts"]
+    except (ValueError, KeyError, IndexError):
+        return ""
+    return "".join(p.get("text", "") for p in parts)
+
+
+def _throttled(resp, attempt: int) -> bool:
+    """
+    True if resp is a 429 worth retrying; the shared quota is then paused
+    for its Retry-After (or a backoff).
+    """
+    if resp.status_code != 429 or attempt >= QUOTA_MAX_RETRIES:
+        return False
+    generation_quota.throttle(backoff_seconds(attempt, retry_after_seconds(resp.headers, resp.text)))
+    return True
+
+
+def ask_gemini(prompt: str) -> str:
+    """
+    Calls Gemini with a raw text prompt and returns text.
+    """
+    for attempt in range(QUOTA_MAX_RETRIES + 1):
+        generation_quota.acquire()
+        with span("llm"):
+            resp = _client.post(_gemini_url(), json=_gemini_payload(prompt))
+        if not _throttled(resp, attempt):
+            break
+    return _extract_text(resp, prompt)
+
+
+async def aask_gemini(prompt: str) -> str:
+    """
+    Async version of ask_gemini, limited to GEMINI_CONCURRENCY in-flight calls.
+    """
+    return await generation_flight.do(prompt, _aask_gemini, prompt)
+
+
+async def _aask_gemini(prompt: str) -> str:
+    for attempt in range(QUOTA_MAX_RETRIES + 1):
+        await generation_quota.aacquire()
+        async with gemini_upstream.semaphore:
+            with span("llm"):
+                try:
+                    resp = await _async_client.post(_gemini_url(), json=_gemini_payload(prompt))
+                except httpx.HTTPError:
+                    upstream_errors.inc(upstream="gemini")
+                    raise
+        if not _throttled(resp, attempt):
+            break
+    return _extract_text(resp, prompt)
+
+
+def stream_gemini(prompt: str):
+    """
+    Calls streamGenerateContent and yields text fragments as they arrive.
+    """
+    generation_quota.acquire()
+    with _client.stream("POST", _gemini_url("streamGenerateContent"), json=_gemini_payload(prompt)) as resp:
+        if resp.status_code != 200:
+            resp.read()
+            yield f"Error: {resp.text}"
+            return
+        for line in resp.iter_lines():
+            text = _sse_text(line)
+            if text:
+                yield text
+
+
+async def astream_gemini(prompt: str):
+    """
+    Async version of stream_gemini. Callers streaming the same prompt at
+    the same time share one upstream stream.
+    """
+    async for text in stream_flight.stream(prompt, lambda: _astream_gemini(prompt)):
+        yield text
+
+
+async def _astream_gemini(prompt: str):
+    # Timed from the first attempt, so quota waits and 429 retries count
+    t0 = time.perf_counter()
+    parts = []
+    for attempt in range(QUOTA_MAX_RETRIES + 1):
+        await generation_quota.aacquire()
+        async with gemini_upstream.semaphore:
+            try:
+                async with _async_client.stream("POST", _gemini_url("streamGenerateContent"), json=_gemini_payload(prompt)) as resp:
+                    if resp.status_code != 200:
+                        await resp.aread()
+                        if _throttled(resp, attempt):
+                            continue
+                        upstream_errors.inc(upstream="gemini")
+                        yield f"Error: {resp.text}"
+                        return
+                    async for line in resp.aiter_lines():
+                        text = _sse_text(line)
+                        if text:
+                            if not parts:
+                                observe_stage("llm_first_token", time.perf_counter() - t0)
+                            parts.append(text)
+                            yield text
+            except httpx.HTTPError:
+                upstream_errors.inc(upstream="gemini")
+                raise
+        break
+    observe_stage("llm", time.perf_counter() - t0)
+    _count_tokens(prompt, "".join(parts))
+
+
+def _clarification_prompt(query: str, context: str) -> str:
+    return f"""
     The user asked a possibly ambiguous question: "{query}"
     Based on the following context:
     "{context}"
     Generate a concise clarifying question to ask the user.
     """
-    return ask_gemini(prompt)
+
+
+def generate_clarification(query: str, context: str) -> str:
+    """
+    Generates a clarifying question for ambiguous queries.
+    """
+    with span("clarification"):
+        return ask_gemini(_clarification_prompt(query, context))
+
+
+async def agenerate_clarification(query: str, context: str) -> str:
+    with span("clarification"):
+        return await aask_gemini(_clarification_prompt(query, context))
 
 
 def check_ambiguity(query: str, context: str) -> bool:
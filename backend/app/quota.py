@@ -0,0 +1,262 @@
+# app/quota.py
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+from .metrics import Counter, Histogram, register_gauge
+
+# Priority classes: lower is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+# Priority of upstream calls made by the current request or job when none is given
+current_priority: ContextVar[int] = ContextVar("upstream_priority", default=INTERACTIVE)
+
+# Requests per minute allowed per (api, model); 0 disables the rate limit
+QUOTA_RPM = {
+    "embed": float(os.getenv("EMBED_RPM", "1500")),
+    "generate": float(os.getenv("GEMINI_RPM", "1000")),
+}
+# Bucket size, in seconds of the rate: how much a quiet period lets burst
+QUOTA_BURST_SECONDS = float(os.getenv("QUOTA_BURST_SECONDS", "1.0"))
+# Share of the bucket background work may not use, kept for interactive calls
+QUOTA_INTERACTIVE_RESERVE = float(os.getenv("QUOTA_INTERACTIVE_RESERVE", "0.25"))
+# Retries after a 429, and the backoff used when the response has no Retry-After
+QUOTA_MAX_RETRIES = int(os.getenv("QUOTA_MAX_RETRIES", "3"))
+QUOTA_BACKOFF_SECONDS = float(os.getenv("QUOTA_BACKOFF_SECONDS", "1.0"))
+QUOTA_MAX_BACKOFF_SECONDS = 60.0
+
+quota_wait_seconds = Histogram(
+    "rag_upstream_quota_wait_seconds",
+    "Time calls waited for upstream quota, by api, model and priority.",
+)
+throttled_calls = Counter("rag_upstream_throttled_total", "429 responses from upstream APIs.")
+
+
+class _Ticket:
+    """
+    One queued call: a thread waiting on event, or a coroutine awaiting future.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.cancelled = False
+
+    def grant(self):
+        if self.event is not None:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+        except RuntimeError:
+            pass  # the waiter's loop is gone
+
+
+class QuotaScheduler:
+    """
+    Token bucket for one upstream API and model, shared by every caller in
+    the process. Calls that find no token queue by priority, so queued
+    interactive calls always go before queued ingestion, and background
+    calls leave QUOTA_INTERACTIVE_RESERVE of the bucket untouched. A 429
+    pauses the bucket for everyone until its Retry-After has passed.
+    """
+
+    def __init__(self, api: str, model: str, rpm: float):
+        self.api = api
+        self.model = model
+        self.rate = rpm / 60.0
+        self.burst = max(1.0, self.rate * QUOTA_BURST_SECONDS)
+        self.reserve = float(int(self.burst * QUOTA_INTERACTIVE_RESERVE))
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._dispatcher = None
+
+    def _refill(self, now: float):
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _take(self, priority: int, now: float) -> Optional[float]:
+        """
+        Takes a token if one is free for this priority. Returns None if it
+        did, else the seconds until one could be. Caller holds the lock.
+        """
+        if now < self._paused_until:
+            return self._paused_until - now
+        if not self.rate:
+            return None
+        self._refill(now)
+        need = 1.0 + (self.reserve if priority > INTERACTIVE else 0.0)
+        if self._tokens >= need:
+            self._tokens -= 1.0
+            return None
+        return (need - self._tokens) / self.rate
+
+    def _enqueue(self, priority: int, ticket: _Ticket):
+        heapq.heappush(self._queue, (priority, next(self._seq), ticket))
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch, daemon=True,
+                                                name=f"quota-{self.api}-{self.model}")
+            self._dispatcher.start()
+        self._cond.notify_all()
+
+    def _dispatch(self):
+        """
+        Grants queued tickets in priority order as tokens come in.
+        """
+        while True:
+            with self._cond:
+                while self._queue and self._queue[0][2].cancelled:
+                    heapq.heappop(self._queue)
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                wait = self._take(self._queue[0][0], time.monotonic())
+                if wait is not None:
+                    self._cond.wait(wait)
+                    continue
+                _, _, ticket = heapq.heappop(self._queue)
+            ticket.grant()
+
+    def _observe(self, priority: int, t0: float):
+        quota_wait_seconds.observe(time.monotonic() - t0, api=self.api, model=self.model,
+                                   priority=PRIORITY_NAMES[priority])
+
+    def acquire(self, priority: Optional[int] = None):
+        """
+        Blocks until this thread may make one call.
+        """
+        priority = current_priority.get() if priority is None else priority
+        t0 = time.monotonic()
+        with self._cond:
+            if not self._queue and self._take(priority, t0) is None:
+                self._observe(priority, t0)
+                return
+            ticket = _Ticket()
+            self._enqueue(priority, ticket)
+        ticket.event.wait()
+        self._observe(priority, t0)
+
+    async def aacquire(self, priority: Optional[int] = None):
+        """
+        acquire() for coroutines; waiting does not block the event loop.
+        """
+        priority = current_priority.get() if priority is None else priority
+        t0 = time.monotonic()
+        with self._cond:
+            if not self._queue and self._take(priority, t0) is None:
+                self._observe(priority, t0)
+                return
+            ticket = _Ticket(asyncio.get_running_loop())
+            self._enqueue(priority, ticket)
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            ticket.cancelled = True
+            raise
+        self._observe(priority, t0)
+
+    def throttle(self, seconds: float):
+        """
+        Called on a 429: no call is granted for the next seconds.
+        """
+        throttled_calls.inc(api=self.api, model=self.model)
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            # Tokens only start coming back once the pause is over
+            self._tokens, self._stamp = 0.0, self._paused_until
+            self._cond.notify_all()
+
+    def call(self, fn, *args, priority: Optional[int] = None, **kwargs):
+        """
+        fn(*args, **kwargs) under this quota, retried after 429 errors.
+        """
+        for attempt in itertools.count():
+            self.acquire(priority)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt >= QUOTA_MAX_RETRIES:
+                    raise
+                self.throttle(backoff_seconds(attempt, retry_after_seconds(text=str(e))))
+
+    def depth(self) -> Dict[int, int]:
+        with self._cond:
+            counts = {p: 0 for p in PRIORITY_NAMES}
+            for priority, _, ticket in self._queue:
+                if not ticket.cancelled:
+                    counts[priority] += 1
+            return counts
+
+
+def is_rate_limited(error: Exception) -> bool:
+    # google.api_core raises ResourceExhausted (code 429) for quota errors
+    return getattr(error, "code", None) == 429 or type(error).__name__ == "ResourceExhausted"
+
+
+def retry_after_seconds(headers=None, text: str = "") -> Optional[float]:
+    """
+    The server's requested delay: a Retry-After header (seconds or an HTTP
+    date), else a RetryInfo delay in the error body.
+    """
+    value = (headers or {}).get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    match = re.search(r'retryDelay"?\s*:\s*"(\d+(?:\.\d+)?)s"|retry_delay\s*\{\s*seconds:\s*(\d+)', text or "")
+    if match:
+        return float(match.group(1) or match.group(2))
+    return None
+
+
+def backoff_seconds(attempt: int, retry_after: Optional[float] = None) -> float:
+    if retry_after is not None:
+        return retry_after
+    return min(QUOTA_MAX_BACKOFF_SECONDS, QUOTA_BACKOFF_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+_schedulers: Dict[Tuple[str, str], QuotaScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def quota(api: str, model: str) -> QuotaScheduler:
+    """
+    The scheduler for an API ("embed" or "generate") and model.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get((api, model))
+        if scheduler is None:
+            scheduler = _schedulers[(api, model)] = QuotaScheduler(api, model, QUOTA_RPM.get(api, 0.0))
+        return scheduler
+
+
+def _queue_depths() -> dict:
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    return {
+        (("api", s.api), ("model", s.model), ("priority", PRIORITY_NAMES[p])): n
+        for s in schedulers for p, n in s.depth().items()
+    }
+
+
+register_gauge("rag_upstream_queue_depth", "Calls waiting for upstream quota, by api, model and priority.",
+               _queue_depths)
@@ -0,0 +1,133 @@
+# app/response_cache.py
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .cache import make_cache, normalize_query
+from .corpus import CORPUS_VERSION_PATH
+
+# Cached answers are invalidated by corpus versions, which only reach every
+# worker through a shared CORPUS_VERSION_PATH: with in-process versions an
+# upload or delete handled by one worker leaves the others serving stale
+# answers. So the cache is off by default without it; set
+# RESPONSE_CACHE_ENABLED=1 to use it anyway with a single worker.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1" if CORPUS_VERSION_PATH else "0") == "1"
+if RESPONSE_CACHE_ENABLED and not CORPUS_VERSION_PATH:
+    print("Response cache enabled with in-process corpus versions: only safe with a single worker.")
+# Cosine similarity above which a different question reuses a cached answer
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+# Cached question embeddings kept per user for near-duplicate lookups
+RESPONSE_CACHE_SEMANTIC_PER_USER = int(os.getenv("RESPONSE_CACHE_SEMANTIC_PER_USER", "256"))
+RESPONSE_CACHE_SEMANTIC_USERS = int(os.getenv("RESPONSE_CACHE_SEMANTIC_USERS", "1024"))
+
+
+class ResponseCache:
+    """
+    Full-answer cache keyed on (user, corpus version, top_k, normalized
+    question). A miss on the exact key falls back to the closest cached
+    question of the same user, corpus version and top_k, if its embedding
+    is similar enough.
+    """
+
+    def __init__(self):
+        self.store = make_cache(
+            maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "4096")),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600))),
+            path=os.getenv("RESPONSE_CACHE_PATH", ""),
+            table="responses",
+            max_rows=int(os.getenv("RESPONSE_CACHE_MAX_ROWS", "100000")),
+        )
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # user_id -> {"version", "keys", "top_k", "matrix"} for near-duplicate lookups
+        self._semantic: "OrderedDict[str, dict]" = OrderedDict()
+
+    @staticmethod
+    def _key(user_id: str, version: int, top_k: int, question: str) -> str:
+        return f"{user_id}:{version}:{top_k}:{normalize_query(question)}"
+
+    def get_exact(self, user_id: str, question: str, version: int, top_k: int) -> Optional[dict]:
+        if not RESPONSE_CACHE_ENABLED:
+            return None
+        value = self.store.get(self._key(user_id, version, top_k, question))
+        if value is not None:
+            self.hits += 1
+        return value
+
+    def get_similar(self, user_id: str, embedding: list, version: int, top_k: int) -> Optional[dict]:
+        """
+        Looks up a near-duplicate question. Counts a miss when nothing matches,
+        so call it after get_exact.
+        """
+        if not RESPONSE_CACHE_ENABLED:
+            return None
+        with self._lock:
+            entry = self._semantic.get(user_id)
+            if entry and entry["version"] == version and entry["keys"]:
+                query = np.asarray(embedding, dtype=np.float32)
+                query /= np.linalg.norm(query) or 1.0
+                scores = np.where(entry["top_k"] == top_k, entry["matrix"] @ query, -np.inf)
+                best = int(np.argmax(scores))
+                key = entry["keys"][best] if scores[best] >= RESPONSE_CACHE_SIMILARITY else None
+            else:
+                key = None
+        value = self.store.get(key) if key else None
+        if value is not None:
+            self.semantic_hits += 1
+        else:
+            self.misses += 1
+        return value
+
+    def set(self, user_id: str, question: str, embedding: Optional[list], response: dict, version: int,
+            top_k: int):
+        """
+        Stores an answer generated from the given corpus version; pass the
+        version read before retrieval so a concurrent upload can't be masked.
+        """
+        if not RESPONSE_CACHE_ENABLED:
+            return
+        key = self._key(user_id, version, top_k, question)
+        self.store.set(key, response)
+        if embedding is None:
+            return
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            entry = self._semantic.get(user_id)
+            if not entry or entry["version"] != version:
+                entry = {"version": version, "keys": [], "top_k": np.empty(0, dtype=np.int64),
+                         "matrix": np.empty((0, len(vector)), dtype=np.float32)}
+            if key not in entry["keys"]:
+                entry["keys"] = (entry["keys"] + [key])[-RESPONSE_CACHE_SEMANTIC_PER_USER:]
+                entry["top_k"] = np.append(entry["top_k"], top_k)[-RESPONSE_CACHE_SEMANTIC_PER_USER:]
+                entry["matrix"] = np.vstack([entry["matrix"], vector])[-RESPONSE_CACHE_SEMANTIC_PER_USER:]
+            self._semantic[user_id] = entry
+            self._semantic.move_to_end(user_id)
+            while len(self._semantic) > RESPONSE_CACHE_SEMANTIC_USERS:
+                self._semantic.popitem(last=False)
+
+    def invalidate_user(self, user_id: str):
+        # Old entries become unreachable once the corpus version changes;
+        # this only frees the near-duplicate index early.
+        with self._lock:
+            self._semantic.pop(user_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "store": self.store.stats(),
+        }
+
+
+response_cache = ResponseCache()
+
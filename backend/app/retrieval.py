@@ -1,6 +1,15 @@
 import os
+import asyncio
+import functools
 from dotenv import load_dotenv
 from .db import supabase
+from .upstream import embedding_upstream, supabase_upstream
+from .cache import make_cache, normalize_query
+from .vector_index import VectorIndexStore
+from .lexical import LexicalIndexStore, reciprocal_rank_fusion
+from .metrics import span
+from .singleflight import SingleFlight
+from .quota import quota
 import google.generativeai as genai
 #  CHECKPOINT WORKING Fully functional
 load_dotenv()
@@ -9,34 +18,294 @@ load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=GOOGLE_API_KEY)
 
+EMBEDDING_MODEL = "models/embedding-001"
+# Shared with ingestion, which queues behind interactive queries
+embed_quota = quota("embed", EMBEDDING_MODEL)
+# embedContent accepts up to 100 contents per batch request
+QUERY_EMBED_BATCH_SIZE = 100
+
+# "supabase": match_documents_user RPC, "local": per-user NumPy index on disk,
+# "ann": per-index IVF approximate search for very large corpora
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "supabase")
+LOCAL_BACKENDS = ("local", "ann")
+# "float16" or "int8": the local backend scans a compact copy of its
+# vectors and re-ranks the best candidates exactly
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "")
+BACKFILL_PAGE_SIZE = 1000
+
+# Fuse BM25 keyword hits with the vector results (reciprocal rank fusion).
+# The BM25 index lives on local disk under LEXICAL_INDEX_DIR, like the local
+# vector backends, so it is only on by default with them; with the supabase
+# backend, enable it only if every worker and host shares that directory,
+# or deletes made elsewhere never reach it.
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1" if RETRIEVAL_BACKEND in LOCAL_BACKENDS else "0") == "1"
+# Candidates taken from each retriever before fusion, as a multiple of top_k
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "3"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+
+_vector_store = None
+lexical_store = LexicalIndexStore()
+
+
+def get_vector_store() -> VectorIndexStore:
+    global _vector_store
+    if _vector_store is None:
+        if RETRIEVAL_BACKEND == "ann":
+            from .ann_index import IVFIndex
+            _vector_store = VectorIndexStore(index_cls=IVFIndex)
+        elif VECTOR_INDEX_QUANTIZATION:
+            from .quantized_index import QuantizedVectorIndex
+            _vector_store = VectorIndexStore(
+                index_cls=functools.partial(QuantizedVectorIndex, dtype=VECTOR_INDEX_QUANTIZATION)
+            )
+        else:
+            _vector_store = VectorIndexStore()
+    return _vector_store
+
+# Query embedding cache: in-process LRU, plus an optional SQLite file
+# shared by all uvicorn workers and kept across restarts
+embedding_cache = make_cache(
+    maxsize=int(os.getenv("EMBED_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("EMBED_CACHE_TTL", str(7 * 24 * 3600))),
+    path=os.getenv("EMBED_CACHE_PATH", ""),
+    table="query_embeddings",
+    max_rows=int(os.getenv("EMBED_CACHE_MAX_ROWS", "100000")),
+)
+embedding_flight = SingleFlight("query_embedding")
+
 print("Using Google GenAI embeddings with API key for retrieval...")
 
-def retrieve_chunks(query: str, user_id: str, top_k: int = 3):
-    # Generate embedding for query
-    embedding_resp = genai.embed_content(
-        model="models/embedding-001",
-        content=query
-    )
-    query_embedding = embedding_resp["embedding"]
 
-    resp = supabase.rpc(
-        "match_documents_user",
-        {"query_embedding": query_embedding, "match_count": top_k, "p_user_id": user_id}
-    ).execute()
+def _embedding_key(query: str) -> str:
+    # Spelling variants of a question share one cached embedding
+    return f"{EMBEDDING_MODEL}:{normalize_query(query)}"
+
+
+def _embed_uncached(key: str, query: str) -> list:
+    with span("embed_query"):
+        embedding_resp = embed_quota.call(
+            genai.embed_content,
+            model=EMBEDDING_MODEL,
+            content=query
+        )
+    embedding = embedding_resp["embedding"]
+    embedding_cache.set(key, embedding)
+    return embedding
+
+
+def _shared_or_embed(key: str, query: str) -> list:
+    # Runs on the embedding executor: the SQLite tier is never read on the event loop
+    embedding = embedding_cache.get_shared(key)
+    if embedding is not None:
+        return embedding
+    return _embed_uncached(key, query)
+
+
+def embed_query(query: str) -> list:
+    key = _embedding_key(query)
+    embedding = embedding_cache.get(key)
+    if embedding is not None:
+        return embedding
+    return _embed_uncached(key, query)
+
+
+def embed_queries(queries: list) -> list:
+    """
+    embed_query for many queries: cached embeddings are reused and the
+    remaining distinct questions are embedded together, in batches.
+    """
+    keys = [_embedding_key(q) for q in queries]
+    found = {}
+    for key in keys:
+        embedding = embedding_cache.get(key)
+        if embedding is not None:
+            found[key] = embedding
+    # key -> the first question with that key; the original text is embedded
+    missing = {}
+    for key, query in zip(keys, queries):
+        if key not in found:
+            missing.setdefault(key, query)
+    missing = list(missing.items())
+    for start in range(0, len(missing), QUERY_EMBED_BATCH_SIZE):
+        batch = missing[start:start + QUERY_EMBED_BATCH_SIZE]
+        with span("embed_query"):
+            embedding_resp = embed_quota.call(genai.embed_content, model=EMBEDDING_MODEL,
+                                              content=[query for _, query in batch])
+        for (key, _), embedding in zip(batch, embedding_resp["embedding"]):
+            embedding_cache.set(key, embedding)
+            found[key] = embedding
+    return [found[key] for key in keys]
+
+
+def _load_user_chunks(user_id: str, columns: str = "content, embedding, metadata, file_id") -> list:
+    """
+    Reads all of a user's chunk rows from Supabase, to backfill a local index.
+    Pages are ordered by id; without an order Postgres may skip or repeat
+    rows between pages.
+    """
+    rows, start = [], 0
+    while True:
+        resp = supabase.table("chunks").select(columns) \
+            .eq("user_id", user_id).order("id").range(start, start + BACKFILL_PAGE_SIZE - 1).execute()
+        rows.extend(resp.data or [])
+        if len(resp.data or []) < BACKFILL_PAGE_SIZE:
+            return rows
+        start += BACKFILL_PAGE_SIZE
+
+
+def match_chunks(query_embedding: list, user_id: str, top_k: int) -> list:
+    with span("vector_search"):
+        if RETRIEVAL_BACKEND in LOCAL_BACKENDS:
+            return get_vector_store().search(user_id, query_embedding, top_k, loader=_load_user_chunks)
+
+        resp = supabase.rpc(
+            "match_documents_user",
+            {"query_embedding": query_embedding, "match_count": top_k, "p_user_id": user_id}
+        ).execute()
+        return resp.data or []
+
+
+def match_chunks_many(query_embeddings: list, user_id: str, top_k: int) -> list:
+    """
+    match_chunks for several embeddings; the local backends score them all
+    in one pass over the index.
+    """
+    if RETRIEVAL_BACKEND not in LOCAL_BACKENDS:
+        return [match_chunks(e, user_id, top_k) for e in query_embeddings]
+    with span("vector_search"):
+        return get_vector_store().search_many(user_id, query_embeddings, top_k, loader=_load_user_chunks)
+
+
+def _load_user_texts(user_id: str) -> list:
+    return _load_user_chunks(user_id, columns="content, metadata, file_id")
 
-    if not resp.data:
+
+def match_lexical(query: str, user_id: str, top_k: int) -> list:
+    if not HYBRID_RETRIEVAL:
+        return []
+    with span("lexical_search"):
+        return lexical_store.search(user_id, query, top_k, loader=_load_user_texts)
+
+
+def match_lexical_many(queries: list, user_id: str, top_k: int) -> list:
+    return [match_lexical(q, user_id, top_k) for q in queries]
+
+
+def fuse_matches(vector_rows: list, lexical_rows: list, top_k: int) -> list:
+    if not lexical_rows:
+        return vector_rows[:top_k]
+    return reciprocal_rank_fusion(
+        [vector_rows, lexical_rows],
+        key=lambda r: r["content"],
+        weights=[1.0, HYBRID_LEXICAL_WEIGHT],
+    )[:top_k]
+
+
+def _candidates(top_k: int) -> int:
+    return top_k * HYBRID_CANDIDATES if HYBRID_RETRIEVAL else top_k
+
+
+def index_chunks(user_id: str, rows: list):
+    """
+    Called by ingestion after chunk rows are stored, to keep local indexes in sync.
+    """
+    if RETRIEVAL_BACKEND in LOCAL_BACKENDS:
+        get_vector_store().add(user_id, rows, loader=_load_user_chunks)
+    if HYBRID_RETRIEVAL:
+        lexical_store.add(user_id, rows, loader=_load_user_texts)
+
+
+def remove_files(user_id: str, file_ids: list):
+    """
+    Called after a user's files are deleted, to drop them from local indexes.
+    """
+    if RETRIEVAL_BACKEND in LOCAL_BACKENDS:
+        get_vector_store().delete_files(user_id, file_ids)
+    if HYBRID_RETRIEVAL:
+        lexical_store.delete_files(user_id, file_ids)
+
+
+def _format_matches(rows: list):
+    if not rows:
         return [], ""
 
     chunks = []
-    for c in resp.data:
+    for c in rows:
         md = c.get("metadata") or {}
         chunks.append({
             "content": c["content"],
             "source": c.get("source"),
+            "file_id": c.get("file_id"),
             "page": md.get("page_number"),
             "similarity": c.get("similarity"),
+            "lexical_coverage": c.get("lexical_coverage"),
+            "score": c.get("rrf_score", c.get("similarity")),
             "metadata": md
         })
 
     raw_context = "\n\n".join([c["content"] for c in chunks])
     return chunks, raw_context
+
+
+def retrieve_chunks(query: str, user_id: str, top_k: int = 3):
+    # Generate embedding for query
+    query_embedding = embed_query(query)
+    vector_rows = match_chunks(query_embedding, user_id, _candidates(top_k))
+    lexical_rows = match_lexical(query, user_id, _candidates(top_k))
+    return _format_matches(fuse_matches(vector_rows, lexical_rows, top_k))
+
+
+def retrieve_many(queries: list, user_id: str, top_k: int = 3) -> list:
+    """
+    retrieve_chunks for a list of queries, with one batched embedding call.
+    Returns one (chunks, raw_context) per query, in order.
+    """
+    embeddings = embed_queries(queries)
+    vector_rows = match_chunks_many(embeddings, user_id, _candidates(top_k))
+    lexical_rows = match_lexical_many(queries, user_id, _candidates(top_k))
+    return [_format_matches(fuse_matches(v, l, top_k)) for v, l in zip(vector_rows, lexical_rows)]
+
+
+async def aembed_query(query: str) -> list:
+    # In-memory hits are answered without an executor hop
+    key = _embedding_key(query)
+    embedding = embedding_cache.memory.get(key)
+    if embedding is not None:
+        return embedding
+    # Identical questions arriving together share one lookup and embedding call
+    return await embedding_flight.do(key, embedding_upstream.run, _shared_or_embed, key, query)
+
+
+async def aretrieve_chunks(query: str, user_id: str, top_k: int = 3):
+    """
+    Same as retrieve_chunks, but runs the blocking embedding and RPC calls
+    on their own upstream executors instead of the event loop.
+    """
+    query_embedding = await aembed_query(query)
+    vector_rows, lexical_rows = await asyncio.gather(
+        supabase_upstream.run(match_chunks, query_embedding, user_id, _candidates(top_k)),
+        supabase_upstream.run(match_lexical, query, user_id, _candidates(top_k)),
+    )
+    return _format_matches(fuse_matches(vector_rows, lexical_rows, top_k))
+
+
+async def aretrieve_many(queries: list, user_id: str, top_k: int = 3):
+    """
+    Async retrieve_many. Returns (embeddings, results) so callers can reuse
+    the query embeddings. Without a local index there is no batched RPC,
+    so the per-query match_documents_user calls run concurrently instead.
+    """
+    embeddings = await embedding_upstream.run(embed_queries, queries)
+    candidates = _candidates(top_k)
+    if RETRIEVAL_BACKEND in LOCAL_BACKENDS:
+        vector_search = supabase_upstream.run(match_chunks_many, embeddings, user_id, candidates)
+    else:
+        vector_search = asyncio.gather(*[
+            supabase_upstream.run(match_chunks, e, user_id, candidates) for e in embeddings
+        ])
+    vector_rows, lexical_rows = await asyncio.gather(
+        vector_search,
+        supabase_upstream.run(match_lexical_many, queries, user_id, candidates),
+    )
+    results = [_format_matches(fuse_matches(v, l, top_k)) for v, l in zip(vector_rows, lexical_rows)]
+    return embeddings, results
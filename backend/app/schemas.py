@@ -1,13 +1,19 @@
 # app/schemas.py
 #  CHECKPOINT WORKING Fully functional
-from pydantic import BaseModel, Field
-from typing import List, Optional, Any
+from pydantic import BaseModel, Field, constr
+from typing import List, Optional, Any, Dict
 
 class AskRequest(BaseModel):
     question: str = Field(..., min_length=1)
     top_k: int = 4
     debug: bool = False
 
+class AskBatchRequest(BaseModel):
+    # Each question is validated like AskRequest.question, so a bad item is a 422 up front
+    questions: List[constr(min_length=1)] = Field(..., min_length=1)
+    top_k: int = 4
+    debug: bool = False
+
 class Source(BaseModel):
     source: Optional[str] = None
     page: Optional[int] = None
@@ -28,3 +34,5 @@ class AskResponse(BaseModel):
     debug_context: Optional[str] = None
     clarification_required: Optional[bool] = False
     clarification_question: Optional[str] = None
+    clarification_options: List[Source] = []
+    debug_info: Optional[Dict[str, Any]] = None
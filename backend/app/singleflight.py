@@ -0,0 +1,112 @@
+# app/singleflight.py
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Set
+
+from .metrics import Counter
+
+singleflight_calls = Counter(
+    "rag_singleflight_calls_total",
+    "Coalesced upstream calls by flight; result=collapsed calls shared another caller's result.",
+)
+
+
+class _Broadcast:
+    def __init__(self):
+        self.parts: list = []
+        self.done = False
+        self.error = None
+        self.cond = asyncio.Condition()
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one upstream call
+    whose result (or exception) every caller receives. Nothing is kept
+    once the call finishes; caching is done elsewhere.
+
+    The shared call runs as its own task, so a caller that goes away
+    does not cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.leaders = 0
+        self.collapsed = 0
+        self._inflight: Dict[Hashable, Any] = {}
+        # Running stream pumps; the event loop only keeps weak references to tasks
+        self._pumps: Set[asyncio.Task] = set()
+
+    def _count(self, leader: bool):
+        if leader:
+            self.leaders += 1
+        else:
+            self.collapsed += 1
+        singleflight_calls.inc(flight=self.name, result="leader" if leader else "collapsed")
+
+    async def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """
+        await fn(*args, **kwargs), shared with concurrent callers of the same key.
+        """
+        task = self._inflight.get(key)
+        self._count(task is None)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every caller went away
+
+    async def stream(self, key: Hashable, gen_factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """
+        Iterates gen_factory(), shared with concurrent callers of the same
+        key. Late joiners first receive the items already produced.
+        """
+        broadcast = self._inflight.get(key)
+        self._count(broadcast is None)
+        if broadcast is None:
+            broadcast = self._inflight[key] = _Broadcast()
+            pump = asyncio.ensure_future(self._pump(key, broadcast, gen_factory()))
+            self._pumps.add(pump)
+            pump.add_done_callback(self._pumps.discard)
+
+        sent = 0
+        while True:
+            async with broadcast.cond:
+                await broadcast.cond.wait_for(lambda: len(broadcast.parts) > sent or broadcast.done)
+                parts, done, error = broadcast.parts[sent:], broadcast.done, broadcast.error
+            for part in parts:
+                yield part
+            sent += len(parts)
+            if done and sent == len(broadcast.parts):
+                if error is not None:
+                    raise error
+                return
+
+    async def _pump(self, key: Hashable, broadcast: _Broadcast, gen: AsyncIterator):
+        try:
+            async for part in gen:
+                async with broadcast.cond:
+                    broadcast.parts.append(part)
+                    broadcast.cond.notify_all()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            if self._inflight.get(key) is broadcast:
+                del self._inflight[key]
+            async with broadcast.cond:
+                broadcast.done = True
+                broadcast.cond.notify_all()
+
+    def stats(self) -> dict:
+        total = self.leaders + self.collapsed
+        return {
+            "in_flight": len(self._inflight),
+            "upstream_calls": self.leaders,
+            "collapsed": self.collapsed,
+            "collapse_rate": self.collapsed / total if total else 0.0,
+        }
@@ -0,0 +1,60 @@
+# app/upstream.py
+import os
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .metrics import upstream_errors
+
+
+class Upstream:
+    """
+    Concurrency limit of `limit` calls for one upstream service, so a slow
+    service cannot starve the others. Blocking clients go through run(),
+    on a dedicated thread pool of that size (created on first use), so
+    they never run on the event loop; async clients hold the semaphore
+    instead. Each upstream uses one of the two.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._semaphore = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.limit, thread_name_prefix=f"{self.name}-io")
+            return self._executor
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs a blocking call on this upstream's executor, in a copy of the
+        caller's context so request traces follow it. The executor's size is
+        the limit here; the semaphore is not used.
+        """
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        try:
+            return await loop.run_in_executor(self.executor, partial(ctx.run, fn, *args, **kwargs))
+        except Exception:
+            upstream_errors.inc(upstream=self.name)
+            raise
+
+
+supabase_upstream = Upstream("supabase", int(os.getenv("SUPABASE_CONCURRENCY", "16")))
+embedding_upstream = Upstream("embedding", int(os.getenv("EMBED_CONCURRENCY", "16")))
+# Gemini is called with httpx's async client: only the semaphore is used
+gemini_upstream = Upstream("gemini", int(os.getenv("GEMINI_CONCURRENCY", "32")))
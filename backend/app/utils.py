@@ -1,12 +1,11 @@
 #  CHECKPOINT WORKING Fully functional
+from .pdf_extract import iter_pages
+
 def process_pdf_into_chunks(file_path: str, chunk_size: int = 500):
     """
     Reads a PDF and splits it into text chunks.
     """
-    doc = fitz.open(file_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
+    text = "".join(page_text for _, page_text in iter_pages(file_path))
     # Split into chunks
     chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
     return [{"content": chunk} for chunk in chunks]
@@ -21,7 +20,7 @@ def unique_sources(chunks: List[Dict]) -> List[Dict]:
     seen = {}
     for chunk in chunks:
         src = chunk.get("source")
-        sim = chunk.get("similarity", 0)
+        sim = chunk.get("similarity") or 0
         if src:
             # Keep the chunk with highest similarity
             if src not in seen or sim > seen[src]["similarity"]:
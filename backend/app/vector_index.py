@@ -0,0 +1,363 @@
+# app/vector_index.py
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+import numpy as np
+
+from .filelock import FileLock
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_index")
+# Loaded per-user indexes kept in memory (the matrices themselves are memory-mapped)
+VECTOR_INDEX_MAX_USERS = int(os.getenv("VECTOR_INDEX_MAX_USERS", "256"))
+# Queries scored per matrix product in search_many (bounds the score matrix)
+SEARCH_QUERY_BLOCK = 64
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class _StaleRows(Exception):
+    """
+    rows.jsonl was replaced (compacted) after its offsets were loaded.
+    """
+
+
+def _parse_embedding(value) -> list:
+    # pgvector columns come back from PostgREST as "[0.1,0.2,...]" strings
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class UserVectorIndex:
+    """
+    Append-only, memory-mapped embedding matrix for one user.
+
+    Files in the user's directory:
+      index.json   - {"dim": D}
+      vectors.f32  - row-major float32 unit vectors
+      rows.jsonl   - one JSON line per vector: content, source, metadata, file_id
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header_path = os.path.join(path, "index.json")
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.rows_path = os.path.join(path, "rows.jsonl")
+        self._flock = FileLock(os.path.join(path, ".lock"))
+        self._lock = self._flock.thread_lock
+        self._loaded_stamp = None
+        self._reset()
+
+    def _reset(self):
+        self.dim = 0
+        self.count = 0
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        # Byte offset of each row in rows.jsonl; rows are read on demand
+        self.offsets = np.empty(0, dtype=np.int64)
+        # file_names[file_codes[i]] is the file_id of row i
+        self.file_codes = np.empty(0, dtype=np.int32)
+        self.file_names: List[str] = []
+        # What has been parsed from rows.jsonl so far
+        self._rows_ino = None
+        self._rows_parsed = 0
+        self._all_offsets: List[int] = []
+        self._all_codes: List[int] = []
+
+    def exists(self) -> bool:
+        return os.path.exists(self.rows_path)
+
+    def _file_lock(self) -> FileLock:
+        return self._flock
+
+    def _stamp(self):
+        st = os.stat(self.rows_path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load_if_changed(self):
+        """
+        (Re)maps the files when another worker or job has changed them.
+        """
+        try:
+            stamp = self._stamp()
+        except FileNotFoundError:
+            self._reset()
+            self._loaded_stamp = None
+            return
+        if stamp == self._loaded_stamp:
+            return
+        with open(self.rows_path, "rb") as f:
+            # rows.jsonl only grows between compactions, so usually only the tail is new
+            st = os.fstat(f.fileno())
+            if st.st_ino == self._rows_ino and st.st_size >= self._rows_parsed:
+                pos = self._rows_parsed
+                offsets, codes = self._all_offsets, self._all_codes
+                names = list(self.file_names)
+            else:
+                pos, offsets, codes, names = 0, [], [], []
+            code_of = {name: c for c, name in enumerate(names)}
+            f.seek(pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partially written by a concurrent append
+                if line.strip():
+                    file_id = json.loads(line).get("file_id")
+                    if file_id not in code_of:
+                        code_of[file_id] = len(names)
+                        names.append(file_id)
+                    offsets.append(pos)
+                    codes.append(code_of[file_id])
+                pos += len(line)
+        self._rows_ino, self._rows_parsed = st.st_ino, pos
+        self._all_offsets, self._all_codes = offsets, codes
+        dim = 0
+        if os.path.exists(self.header_path):
+            with open(self.header_path, "r", encoding="utf-8") as f:
+                dim = json.load(f)["dim"]
+        count = 0
+        if dim and os.path.exists(self.vectors_path):
+            # A concurrent append may have written vectors before their rows
+            count = min(len(offsets), os.path.getsize(self.vectors_path) // (4 * dim))
+        if count:
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, dim))
+        else:
+            matrix = np.empty((0, dim), dtype=np.float32)
+        self.dim, self.count, self.matrix = dim, count, matrix
+        self.offsets = np.asarray(offsets[:count], dtype=np.int64)
+        self.file_codes = np.asarray(codes[:count], dtype=np.int32)
+        self.file_names = names
+        self._loaded_stamp = stamp
+        self._on_load()
+
+    def _on_load(self):
+        """
+        Hook for subclasses that keep extra structures over the matrix.
+        """
+
+    def _file_mask(self, file_ids) -> np.ndarray:
+        """
+        Boolean mask of the rows that belong to any of file_ids.
+        """
+        wanted = set(file_ids)
+        codes = [c for c, name in enumerate(self.file_names) if name in wanted]
+        return np.isin(self.file_codes, codes)
+
+    def _read_rows(self, indices) -> List[Dict]:
+        """
+        Reads rows by offset. Raises _StaleRows if rows.jsonl is no longer
+        the file the offsets were parsed from.
+        """
+        rows = []
+        with open(self.rows_path, "rb") as f:
+            if os.fstat(f.fileno()).st_ino != self._rows_ino:
+                raise _StaleRows()
+            for i in indices:
+                f.seek(int(self.offsets[i]))
+                rows.append(json.loads(f.readline()))
+        return rows
+
+    def _results(self, indices: np.ndarray, scores: np.ndarray) -> List[Dict]:
+        return [
+            {
+                "content": row["content"],
+                "source": row["source"],
+                "metadata": row["metadata"],
+                "file_id": row["file_id"],
+                "similarity": float(score),
+            }
+            for row, score in zip(self._read_rows(indices), scores)
+        ]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Positions of the top_k highest scores, best first.
+        """
+        k = min(top_k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def add(self, rows: List[Dict]):
+        """
+        Appends chunk rows (as inserted into the chunks table) to the index.
+        """
+        if not rows:
+            return
+        vectors = _normalize(np.asarray([_parse_embedding(r["embedding"]) for r in rows], dtype=np.float32))
+        dim = vectors.shape[1]
+        with self._file_lock():
+            if not os.path.exists(self.header_path):
+                with open(self.header_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": dim}, f)
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.rows_path, "a", encoding="utf-8") as f:
+                for r in rows:
+                    md = r.get("metadata") or {}
+                    f.write(json.dumps({
+                        "file_id": r.get("file_id"),
+                        "content": r["content"],
+                        "source": md.get("source"),
+                        "metadata": md,
+                    }) + "\n")
+
+    def delete_files(self, file_ids: List[str]) -> int:
+        """
+        Removes every vector belonging to the given files and compacts the
+        files on disk. Returns the number of rows removed.
+        """
+        with self._file_lock():
+            self._load_if_changed()
+            keep = np.flatnonzero(~self._file_mask(file_ids))
+            removed = self.count - len(keep)
+            if not removed:
+                return 0
+            self._rewrite(keep)
+            return removed
+
+    def _rewrite(self, keep: np.ndarray):
+        """
+        Rewrites the files keeping only the given rows, in order. Caller holds the file lock.
+        """
+        tmp_vectors, tmp_rows = self.vectors_path + ".tmp", self.rows_path + ".tmp"
+        with open(tmp_vectors, "wb") as out:
+            for start in range(0, len(keep), 65536):
+                out.write(np.asarray(self.matrix[keep[start:start + 65536]], dtype=np.float32).tobytes())
+        with open(self.rows_path, "rb") as src, open(tmp_rows, "wb") as out:
+            for i in keep:
+                src.seek(int(self.offsets[i]))
+                out.write(src.readline())
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_rows, self.rows_path)
+        self._loaded_stamp = None
+
+    def _consistent(self, fn, *args):
+        """
+        fn(*args) under the in-process lock. If another worker compacted
+        the files after they were loaded here, the row offsets are stale:
+        fn runs again under the file lock, after a reload.
+        """
+        with self._lock:
+            try:
+                return fn(*args)
+            except _StaleRows:
+                pass
+        with self._file_lock():
+            self._loaded_stamp = None
+            return fn(*args)
+
+    def search(self, query_embedding: list, top_k: int) -> List[Dict]:
+        """
+        Exact cosine top-k over the user's chunks, shaped like the
+        match_documents_user RPC result.
+        """
+        return self._consistent(self._search, query_embedding, top_k)
+
+    def _search(self, query_embedding: list, top_k: int) -> List[Dict]:
+        self._load_if_changed()
+        if not self.count:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scores = self.matrix @ query
+        top = self._top_k(scores, top_k)
+        return self._results(top, scores[top])
+
+    def search_many(self, query_embeddings: List[list], top_k: int) -> List[List[Dict]]:
+        """
+        search() for several queries, scoring them together with one
+        matrix product per SEARCH_QUERY_BLOCK queries.
+        """
+        return self._consistent(self._search_many, query_embeddings, top_k)
+
+    def _search_many(self, query_embeddings: List[list], top_k: int) -> List[List[Dict]]:
+        self._load_if_changed()
+        if not self.count:
+            return [[] for _ in query_embeddings]
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+        results = []
+        for start in range(0, len(queries), SEARCH_QUERY_BLOCK):
+            scores = self.matrix @ queries[start:start + SEARCH_QUERY_BLOCK].T
+            for column in scores.T:
+                top = self._top_k(column, top_k)
+                results.append(self._results(top, column[top]))
+        return results
+
+
+class VectorIndexStore:
+    """
+    Lazily opened per-user indexes under VECTOR_INDEX_DIR, least recently
+    used ones are dropped from memory.
+    """
+
+    def __init__(self, root: str = VECTOR_INDEX_DIR, max_users: int = VECTOR_INDEX_MAX_USERS,
+                 index_cls=UserVectorIndex):
+        self.root = root
+        self.max_users = max_users
+        self.index_cls = index_cls
+        self._indexes: "OrderedDict[str, UserVectorIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.root, re.sub(r"[^A-Za-z0-9_.-]", "_", user_id))
+
+    def get(self, user_id: str):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = self.index_cls(self._path(user_id))
+                self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+            return index
+
+    def _backfill(self, user_id: str, index, loader) -> bool:
+        """
+        Builds a missing index from loader(user_id) -> rows. Returns True if it did.
+        """
+        if index.exists() or loader is None:
+            return False
+        with index._file_lock():
+            if index.exists():
+                return False
+            rows = loader(user_id)
+            index.add(rows)
+            if not rows:
+                os.makedirs(index.path, exist_ok=True)
+                open(index.rows_path, "a").close()
+            return True
+
+    def add(self, user_id: str, rows: List[Dict], loader=None):
+        """
+        Appends new chunk rows. A user without a local index is backfilled
+        from loader instead, which already includes rows stored upstream.
+        """
+        index = self.get(user_id)
+        if not self._backfill(user_id, index, loader):
+            index.add(rows)
+
+    def delete_files(self, user_id: str, file_ids: List[str]) -> int:
+        index = self.get(user_id)
+        return index.delete_files(file_ids) if index.exists() else 0
+
+    def search(self, user_id: str, query_embedding: list, top_k: int, loader=None) -> List[Dict]:
+        """
+        loader(user_id) -> rows is used to backfill a user who has no local
+        index yet (e.g. from the Supabase chunks table).
+        """
+        index = self.get(user_id)
+        self._backfill(user_id, index, loader)
+        return index.search(query_embedding, top_k)
+
+    def search_many(self, user_id: str, query_embeddings: List[list], top_k: int, loader=None) -> List[List[Dict]]:
+        index = self.get(user_id)
+        self._backfill(user_id, index, loader)
+        return index.search_many(query_embeddings, top_k)
@@ -0,0 +1,75 @@
+# bench/ann_recall.py
+"""
+Recall@k vs. queries/sec for the IVF index (RETRIEVAL_BACKEND=ann) on a
+synthetic clustered corpus, against exact search as ground truth.
+
+    python bench/ann_recall.py --rows 200000 --nprobe 1 4 16 64
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.ann_index import IVFIndex  # noqa: E402
+from app.vector_index import UserVectorIndex, _normalize  # noqa: E402
+
+
+def clustered(rng, n: int, dim: int, clusters: int) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    return _normalize(centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0, help="0 = automatic")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = clustered(rng, args.rows, args.dim, clusters=max(8, args.rows // 500))
+    queries = clustered(rng, args.queries, args.dim, clusters=args.queries)
+
+    with tempfile.TemporaryDirectory() as root:
+        index = IVFIndex(os.path.join(root, "ivf"))
+        t0 = time.perf_counter()
+        for start in range(0, args.rows, 5000):
+            index.add([
+                {"content": str(i), "embedding": v, "file_id": f"f{i // 5000}", "metadata": {"chunk_index": i}}
+                for i, v in enumerate(data[start:start + 5000], start=start)
+            ])
+        insert_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        index.train(args.nlist)
+        train_s = time.perf_counter() - t0
+        index.search(queries[0], args.top_k)
+        print(f"rows {args.rows}  dim {args.dim}  nlist {len(index.centroids)}  "
+              f"insert {insert_s:.1f}s  train {train_s:.1f}s")
+
+        flat = UserVectorIndex(os.path.join(root, "ivf"))
+        truth, t0 = [], time.perf_counter()
+        for q in queries:
+            truth.append({r["content"] for r in flat.search(q, args.top_k)})
+        exact_qps = len(queries) / (time.perf_counter() - t0)
+
+        print(f"{'nprobe':>7} {'recall@' + str(args.top_k):>10} {'QPS':>9}")
+        print(f"{'exact':>7} {1.0:>10.3f} {exact_qps:>9.1f}")
+        for nprobe in args.nprobe:
+            hits, t0 = 0, time.perf_counter()
+            for q, expected in zip(queries, truth):
+                found = {r["content"] for r in index.search(q, args.top_k, nprobe=nprobe)}
+                hits += len(found & expected)
+            qps = len(queries) / (time.perf_counter() - t0)
+            print(f"{nprobe:>7} {hits / (len(queries) * args.top_k):>10.3f} {qps:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
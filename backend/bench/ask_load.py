@@ -0,0 +1,71 @@
+# bench/ask_load.py
+"""
+Load benchmark for POST /ask against a running backend.
+
+    python bench/ask_load.py --token <jwt> --users 1 4 16 64 --requests 5
+
+Prints requests/sec and latency percentiles for each level of concurrent users.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def _user(client: httpx.AsyncClient, url: str, headers: dict, question: str, n: int, latencies: list, errors: list):
+    for _ in range(n):
+        t0 = time.perf_counter()
+        try:
+            resp = await client.post(url, json={"question": question, "top_k": 4}, headers=headers)
+            if resp.status_code != 200:
+                errors.append(resp.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - t0)
+
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def run_level(base_url: str, token: str, question: str, users: int, requests_per_user: int) -> dict:
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*[
+            _user(client, f"{base_url}/ask", headers, question, requests_per_user, latencies, errors)
+            for _ in range(users)
+        ])
+        elapsed = time.perf_counter() - t0
+    return {
+        "users": users,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": _percentile(latencies, 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--question", default="When is the end semester exam?")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=5, help="requests per user")
+    args = parser.parse_args()
+
+    print(f"{'users':>6} {'reqs':>6} {'errors':>7} {'req/s':>8} {'p50 s':>8} {'p95 s':>8}")
+    for users in args.users:
+        r = asyncio.run(run_level(args.url, args.token, args.question, users, args.requests))
+        print(f"{r['users']:>6} {r['requests']:>6} {r['errors']:>7} {r['rps']:>8.2f} {r['p50']:>8.3f} {r['p95']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
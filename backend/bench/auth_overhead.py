@@ -0,0 +1,62 @@
+# bench/auth_overhead.py
+"""
+Per-request JWT verification cost: full verify vs the verified-token cache
+used by get_current_user. Also checks that forged and expired tokens are
+rejected the same way on both paths.
+
+Needs the backend requirements installed (app.auth imports FastAPI and
+the Supabase client).
+
+    python bench/auth_overhead.py --tokens 1000 --calls 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi import HTTPException  # noqa: E402
+from app import auth  # noqa: E402
+
+
+def _per_call_us(fn, tokens: list, calls: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(calls):
+        fn(tokens[i % len(tokens)])
+    return (time.perf_counter() - t0) / calls * 1e6
+
+
+def _rejection(fn, token: str) -> str:
+    try:
+        fn(token)
+    except HTTPException as e:
+        return f"{e.status_code} {e.detail}"
+    return "accepted"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=1000, help="distinct users / tokens")
+    parser.add_argument("--calls", type=int, default=100000)
+    args = parser.parse_args()
+
+    tokens = [auth.create_jwt(f"user-{i}") for i in range(args.tokens)]
+    full = _per_call_us(lambda t: auth._verify_jwt(t, auth.JWT_SECRET), tokens, args.calls)
+    auth.verified_tokens.clear()
+    cached = _per_call_us(auth._verify_jwt_cached, tokens, args.calls)
+    print(f"{'path':>12} {'us/call':>8}")
+    print(f"{'verify':>12} {full:>8.2f}")
+    print(f"{'cached':>12} {cached:>8.2f}   ({full / cached:.1f}x, cache {auth.verified_tokens.stats()})")
+
+    now = int(time.time())
+    forged = tokens[0][:-4] + ("AAAA" if not tokens[0].endswith("AAAA") else "BBBB")
+    expired = auth._sign_jwt({"user_id": "u", "iss": auth.JWT_ISSUER, "aud": auth.JWT_AUDIENCE,
+                              "iat": now - 20, "exp": now - 10}, auth.JWT_SECRET)
+    for name, token in (("forged", forged), ("expired", expired)):
+        plain = _rejection(lambda t: auth._verify_jwt(t, auth.JWT_SECRET), token)
+        via_cache = _rejection(auth._verify_jwt_cached, token)
+        print(f"{name:>12}: {via_cache}" + ("" if plain == via_cache else f"  (MISMATCH: verify gives {plain})"))
+
+
+if __name__ == "__main__":
+    main()
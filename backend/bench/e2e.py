@@ -0,0 +1,190 @@
+# bench/e2e.py
+"""
+Offline end-to-end benchmark: drives POST /upload (until ingested),
+POST /ask and DELETE /files through the real FastAPI app, with local
+stand-ins for Supabase (bench/mock_supabase.py), Gemini generation
+(bench/mock_gemini.py) and Gemini embeddings (an in-process fake with
+the same latency model). No network access or API keys are needed, but
+the backend requirements must be installed.
+
+    python bench/e2e.py --users 8 --files 2 --asks 20 --concurrency 16
+    python bench/e2e.py --db-latency 0.01 --llm-latency 0.4 --jitter 0.05 --stream
+
+Prints count, errors, throughput and p50/p95/p99 latency per endpoint.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+from mock_gemini import MockGeminiServer  # noqa: E402
+from mock_supabase import MockSupabaseServer  # noqa: E402
+from pdf_extract import write_text_pdf  # noqa: E402
+
+EMBEDDING_DIM = 768
+
+
+def fake_embed_content(latency: float, jitter: float):
+    """
+    Replacement for google.generativeai.embed_content: deterministic
+    pseudo-random unit vectors per text, after latency + uniform(0, jitter).
+    """
+    def vector(text: str) -> list:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        v = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+        return (v / np.linalg.norm(v)).tolist()
+
+    def embed_content(model: str, content, **kwargs):
+        time.sleep(latency + random.uniform(0, jitter))
+        if isinstance(content, list):
+            return {"embedding": [vector(text) for text in content]}
+        return {"embedding": vector(content)}
+
+    return embed_content
+
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] if ordered else 0.0
+
+
+def _report(name: str, latencies: list, errors: list, seconds: float):
+    print(f"{name:>14} {len(latencies):>6} {len(errors):>6} {len(latencies) / seconds:>8.1f} "
+          f"{_percentile(latencies, 0.5) * 1000:>8.1f} {_percentile(latencies, 0.95) * 1000:>8.1f} "
+          f"{_percentile(latencies, 0.99) * 1000:>8.1f}")
+    if errors:
+        print(f"{'':>14} first errors: {errors[:3]}")
+
+
+async def _run_all(jobs: list, concurrency: int):
+    """
+    Runs the coroutine factories in jobs with at most concurrency in flight.
+    Returns (latencies, errors, wall seconds).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+
+    async def one(job):
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                await job()
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[one(job) for job in jobs])
+    return latencies, errors, time.perf_counter() - t0
+
+
+async def run(args, pdf_path: str):
+    import httpx
+    import google.generativeai as genai
+    from app.auth import create_jwt
+    from app.main import app
+
+    genai.embed_content = fake_embed_content(args.embed_latency, args.jitter)
+
+    tokens = {f"bench-user-{u}": create_jwt(f"bench-user-{u}") for u in range(args.users)}
+    file_ids = {user: [] for user in tokens}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://e2e", timeout=300) as client:
+
+        def headers(user):
+            return {"Authorization": f"Bearer {tokens[user]}"}
+
+        def check(resp):
+            if resp.status_code != 200:
+                raise RuntimeError(f"{resp.request.method} {resp.request.url.path} -> {resp.status_code} {resp.text[:200]}")
+            return resp
+
+        async def upload(user, n):
+            with open(pdf_path, "rb") as f:
+                resp = check(await client.post("/upload", headers=headers(user),
+                                               files={"file": (f"handbook-{n}.pdf", f, "application/pdf")}))
+            job = resp.json()
+            file_ids[user].append(job["file_id"])
+            while True:
+                status = check(await client.get(f"/jobs/{job['job_id']}", headers=headers(user))).json()
+                if status["status"] == "completed":
+                    return
+                if status["status"] == "failed":
+                    raise RuntimeError(f"ingestion failed: {status['error']}")
+                await asyncio.sleep(0.02)
+
+        async def ask(user, n):
+            # Worded like the generated handbook so hybrid retrieval finds an exact match
+            question = f"Course CS-{100 + (n * 7) % 400} meets in which room?"
+            path = "/ask/stream" if args.stream else "/ask"
+            check(await client.post(path, headers=headers(user), json={"question": question, "top_k": 4}))
+
+        async def delete(user):
+            check(await client.request("DELETE", "/files", headers=headers(user), json={"file_ids": file_ids[user]}))
+
+        print(f"{'endpoint':>14} {'count':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        _report("upload+ingest", *await _run_all(
+            [lambda u=u, n=n: upload(u, n) for u in tokens for n in range(args.files)], args.concurrency))
+        _report("ask", *await _run_all(
+            [lambda u=u, n=n: ask(u, n) for u in tokens for n in range(args.asks)], args.concurrency))
+        _report("delete", *await _run_all([lambda u=u: delete(u) for u in tokens], args.concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--files", type=int, default=2, help="uploads per user")
+    parser.add_argument("--pages", type=int, default=20, help="pages per uploaded PDF")
+    parser.add_argument("--asks", type=int, default=20, help="questions per user")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stream", action="store_true", help="ask through /ask/stream")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="seconds per Supabase request")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embedding call")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds to first Gemini token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds per streamed token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra uniform(0, jitter) seconds per call")
+    parser.add_argument("--embed-rpm", type=float, default=0, help="EMBED_RPM quota for the run (0 = unlimited)")
+    parser.add_argument("--gemini-rpm", type=float, default=0, help="GEMINI_RPM quota for the run (0 = unlimited)")
+    parser.add_argument("--backend", default="supabase", choices=["supabase", "local", "ann"],
+                        help="RETRIEVAL_BACKEND for the run")
+    args = parser.parse_args()
+
+    supabase_server = MockSupabaseServer(latency=args.db_latency, jitter=args.jitter).start()
+    gemini_server = MockGeminiServer(first_token_delay=args.llm_latency, token_delay=args.token_delay,
+                                     jitter=args.jitter).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Configuration is read at import time, so it must be set before app is imported
+        os.environ.update({
+            "SUPABASE_URL": supabase_server.url,
+            "SUPABASE_KEY": "bench.bench.bench",
+            "GEMINI_BASE_URL": gemini_server.base_url,
+            "GEMINI_API_KEY": "bench",
+            "GOOGLE_API_KEY": "bench",
+            "RETRIEVAL_BACKEND": args.backend,
+            "EMBED_RPM": str(args.embed_rpm),
+            "GEMINI_RPM": str(args.gemini_rpm),
+            "VECTOR_INDEX_DIR": os.path.join(tmp, "vector_index"),
+            "LEXICAL_INDEX_DIR": os.path.join(tmp, "lexical_index"),
+            "UPLOAD_DIR": tmp,
+        })
+        pdf_path = os.path.join(tmp, "handbook.pdf")
+        write_text_pdf(pdf_path, args.pages)
+        try:
+            asyncio.run(run(args, pdf_path))
+        finally:
+            supabase_server.stop()
+            gemini_server.stop()
+    print(f"supabase requests: {supabase_server.requests}, gemini requests: {gemini_server.requests}")
+
+
+if __name__ == "__main__":
+    main()
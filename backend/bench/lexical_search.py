@@ -0,0 +1,69 @@
+# bench/lexical_search.py
+"""
+BM25 lookup latency and on-disk postings size of the per-user lexical
+index on synthetic course-catalogue text.
+
+    python bench/lexical_search.py --sizes 5000 20000 50000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.lexical import LexicalIndexStore  # noqa: E402
+
+WORDS = ("lecture exam lab office hours syllabus grading project deadline room building "
+         "assignment midterm final quiz schedule campus library tutorial seminar credit").split()
+
+
+def _chunk(rng, i: int) -> str:
+    words = list(rng.choice(WORDS, 30))
+    words.insert(rng.integers(0, 30), f"CS-{100 + i % 400}")
+    words.insert(rng.integers(0, 30), f"room B{i % 250}")
+    words.insert(rng.integers(0, 30), f"{1 + i % 28}/{1 + i % 12}/2025")
+    return " ".join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000, 50000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=12)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = [f"when is the CS-{100 + i % 400} {WORDS[i % len(WORDS)]} in room B{i % 250}" for i in range(args.queries)]
+
+    print(f"{'chunks':>8} {'postings KB':>12} {'p50 ms':>8} {'p95 ms':>8} {'cold ms':>8}")
+    with tempfile.TemporaryDirectory() as root:
+        for n in args.sizes:
+            store = LexicalIndexStore(root=root)
+            user_id = f"bench-{n}"
+            rows = [{"content": _chunk(rng, i), "file_id": "f1", "metadata": {"source": "bench.pdf"}} for i in range(n)]
+            for start in range(0, n, 500):
+                store.add(user_id, rows[start:start + 500])
+            size = os.path.getsize(store.get(user_id).postings_path)
+
+            # Fresh store: first query pays loading the postings
+            store = LexicalIndexStore(root=root)
+            t0 = time.perf_counter()
+            store.search(user_id, queries[0], args.top_k)
+            cold = time.perf_counter() - t0
+
+            lat = []
+            for q in queries:
+                t0 = time.perf_counter()
+                store.search(user_id, q, args.top_k)
+                lat.append(time.perf_counter() - t0)
+            lat.sort()
+            print(f"{n:>8} {size / 1024:>12.0f} {statistics.median(lat) * 1000:>8.2f} "
+                  f"{lat[int(len(lat) * 0.95)] * 1000:>8.2f} {cold * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
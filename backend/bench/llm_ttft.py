@@ -0,0 +1,80 @@
+# bench/llm_ttft.py
+"""
+Compares Gemini call latency against a local mock server:
+
+- a new connection per call (the old bare requests.post)
+- the pooled keep-alive client (ask_gemini)
+- time to first token with streamGenerateContent (stream_gemini)
+
+    python bench/llm_ttft.py --connect-delay 0.05 --first-token-delay 0.2 --token-delay 0.02
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.mock_gemini import MockGeminiServer  # noqa: E402
+
+
+def _ms(values: list) -> str:
+    return f"p50 {statistics.median(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--connect-delay", type=float, default=0.05, help="simulated handshake per new connection (s)")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="model latency before the first token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="delay between streamed tokens (s)")
+    args = parser.parse_args()
+
+    server = MockGeminiServer(
+        connect_delay=args.connect_delay,
+        first_token_delay=args.first_token_delay,
+        token_delay=args.token_delay,
+    ).start()
+    os.environ["GEMINI_BASE_URL"] = server.base_url
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    from app import query_llm
+
+    prompt = "When is the end semester exam?"
+    try:
+        fresh = []
+        for _ in range(args.calls):
+            t0 = time.perf_counter()
+            requests.post(query_llm._gemini_url(), json=query_llm._gemini_payload(prompt), timeout=60).json()
+            fresh.append(time.perf_counter() - t0)
+
+        conns = server.connections
+        pooled = []
+        for _ in range(args.calls):
+            t0 = time.perf_counter()
+            query_llm.ask_gemini(prompt)
+            pooled.append(time.perf_counter() - t0)
+        pooled_conns = server.connections - conns
+
+        ttft, total = [], []
+        for _ in range(args.calls):
+            t0 = time.perf_counter()
+            first = None
+            for _ in query_llm.stream_gemini(prompt):
+                if first is None:
+                    first = time.perf_counter() - t0
+            ttft.append(first)
+            total.append(time.perf_counter() - t0)
+    finally:
+        server.stop()
+
+    print(f"HTTP/2: {query_llm.GEMINI_HTTP2}   calls: {args.calls}")
+    print(f"new connection per call     full answer   {_ms(fresh)}")
+    print(f"pooled keep-alive client    full answer   {_ms(pooled)}   ({pooled_conns} connections opened)")
+    print(f"pooled streaming            first token   {_ms(ttft)}")
+    print(f"pooled streaming            full answer   {_ms(total)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# bench/mock_gemini.py
+"""
+Local stand-in for the Gemini generateContent / streamGenerateContent API.
+
+Latency is configurable per connection (simulating TCP+TLS setup), per
+response (time to first token, plus uniform(0, jitter)) and per streamed token.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = (
+    "The end semester examinations start on 2 December and run for two weeks. "
+    "Hall tickets are issued one week before the first paper [S1]."
+)
+
+
+def _candidate(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+class MockGeminiServer:
+    def __init__(self, port: int = 0, connect_delay: float = 0.0, first_token_delay: float = 0.0,
+                 token_delay: float = 0.0, answer: str = ANSWER, jitter: float = 0.0):
+        self.connect_delay = connect_delay
+        self.jitter = jitter
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.answer = answer
+        self.connections = 0
+        self.requests = 0
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                server.connections += 1
+                time.sleep(server.connect_delay)
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                server.requests += 1
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+                method = re.search(r":(\w+)", self.path).group(1)
+                time.sleep(server.first_token_delay + random.uniform(0, server.jitter))
+                if method == "streamGenerateContent":
+                    self._stream()
+                else:
+                    words = server.answer.split(" ")
+                    time.sleep(server.token_delay * (len(words) - 1))
+                    body = json.dumps(_candidate(server.answer)).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = server.answer.split(" ")
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(server.token_delay)
+                    text = word if i == 0 else " " + word
+                    event = f"data: {json.dumps(_candidate(text))}\r\n\r\n".encode()
+                    self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+    def start(self) -> "MockGeminiServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
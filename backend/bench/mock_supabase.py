@@ -0,0 +1,171 @@
+# bench/mock_supabase.py
+"""
+Local stand-in for the parts of Supabase's PostgREST API the backend uses:
+table select / insert / update / delete with eq and in filters, paging,
+and the match_documents_user RPC (exact cosine over the user's chunks).
+
+Every request sleeps latency + uniform(0, jitter) seconds before answering.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+RESERVED_PARAMS = {"select", "limit", "offset", "order", "on_conflict", "columns"}
+
+
+def _field(row: dict, column: str):
+    # "metadata->>content_hash" style JSON paths
+    parts = re.split(r"->>?", column)
+    value = row.get(parts[0])
+    for part in parts[1:]:
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _parse_filter(column: str, expr: str):
+    op, _, value = expr.partition(".")
+    if op == "in":
+        values = {v.strip().strip('"') for v in value.strip("()").split(",") if v.strip()}
+        return lambda row: str(_field(row, column)) in values
+    if op == "eq":
+        return lambda row: str(_field(row, column)) == value
+    if op == "neq":
+        return lambda row: str(_field(row, column)) != value
+    raise ValueError(f"unsupported filter {column}={expr}")
+
+
+class MockSupabaseServer:
+    def __init__(self, port: int = 0, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        # table -> list of rows
+        self.tables = {"files": [], "chunks": [], "users": []}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _new_row(self, table: str, row: dict) -> dict:
+        row = dict(row)
+        if table == "files":
+            row.setdefault("file_id", str(uuid.uuid4()))
+            row.setdefault("uploaded_at", datetime.now(timezone.utc).isoformat())
+        elif table == "chunks":
+            row.setdefault("id", str(uuid.uuid4()))
+        return row
+
+    def _match_documents_user(self, params: dict) -> list:
+        rows = [r for r in self.tables["chunks"] if r.get("user_id") == params["p_user_id"]]
+        if not rows:
+            return []
+        matrix = np.asarray([r["embedding"] for r in rows], dtype=np.float32)
+        query = np.asarray(params["query_embedding"], dtype=np.float32)
+        scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0) + 1e-9)
+        top = np.argsort(-scores)[:params.get("match_count", 5)]
+        return [
+            {"id": rows[i]["id"], "content": rows[i]["content"], "metadata": rows[i]["metadata"],
+             "file_id": rows[i]["file_id"], "similarity": float(scores[i])}
+            for i in top
+        ]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _parse(self):
+                server.requests += 1
+                time.sleep(server.latency + random.uniform(0, server.jitter))
+                parts = urlsplit(self.path)
+                params = parse_qsl(parts.query, keep_blank_values=True)
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length)) if length else None
+                return parts.path, params, body
+
+            def _rows(self, path: str, params: list):
+                table = path.rsplit("/", 1)[-1]
+                filters = [_parse_filter(k, v) for k, v in params if k not in RESERVED_PARAMS]
+                rows = server.tables.setdefault(table, [])
+                return table, rows, [r for r in rows if all(f(r) for f in filters)]
+
+            def _send(self, status: int, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path, params, _ = self._parse()
+                opts = dict(params)
+                with server._lock:
+                    _, _, matched = self._rows(path, params)
+                start = int(opts.get("offset", 0))
+                if "Range" in self.headers:
+                    lo, _, hi = self.headers["Range"].partition("-")
+                    start, opts["limit"] = int(lo), int(hi) - int(lo) + 1
+                matched = matched[start:start + int(opts["limit"])] if "limit" in opts else matched[start:]
+                columns = [c.strip() for c in opts.get("select", "*").split(",")]
+                if "*" not in columns:
+                    matched = [{c: r.get(c) for c in columns} for r in matched]
+                self._send(200, matched)
+
+            def do_POST(self):
+                path, params, body = self._parse()
+                if "/rpc/" in path:
+                    fn = path.rsplit("/", 1)[-1]
+                    if fn != "match_documents_user":
+                        return self._send(404, {"message": f"function {fn} not found"})
+                    with server._lock:
+                        return self._send(200, server._match_documents_user(body))
+                table = path.rsplit("/", 1)[-1]
+                rows = [server._new_row(table, r) for r in (body if isinstance(body, list) else [body])]
+                with server._lock:
+                    server.tables.setdefault(table, []).extend(rows)
+                self._send(201, rows)
+
+            def do_PATCH(self):
+                path, params, body = self._parse()
+                with server._lock:
+                    _, _, matched = self._rows(path, params)
+                    for row in matched:
+                        row.update(body)
+                self._send(200, matched)
+
+            def do_DELETE(self):
+                path, params, _ = self._parse()
+                with server._lock:
+                    table, rows, matched = self._rows(path, params)
+                    dropped = {id(r) for r in matched}
+                    server.tables[table] = [r for r in rows if id(r) not in dropped]
+                self._send(200, matched)
+
+        return Handler
+
+    def start(self) -> "MockSupabaseServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
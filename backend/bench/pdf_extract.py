@@ -0,0 +1,99 @@
+# bench/pdf_extract.py
+"""
+Text extraction throughput: single process vs the page-sharded process
+pool in app.pdf_extract. Uses a generated text PDF unless --pdf is given.
+
+    python bench/pdf_extract.py --pages 600 --workers 1 2 4 8
+    python bench/pdf_extract.py --pdf handbook.pdf
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import pdf_extract  # noqa: E402
+
+LINES_PER_PAGE = 45
+
+
+def write_text_pdf(path: str, pages: int):
+    """
+    Minimal multi-page PDF with one Helvetica text stream per page.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for p in range(pages):
+        lines = [
+            f"({p + 1}.{i} Course CS-{100 + (p * 7 + i) % 400} meets in room B{i % 250} "
+            f"on {1 + i % 28}/{1 + p % 12}/2025, see syllabus section {i}.) Tj T*"
+            for i in range(LINES_PER_PAGE)
+        ]
+        stream = ("BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(lines) + " ET").encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), pages)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for i, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % i + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def _run(path: str, workers: int) -> tuple:
+    pdf_extract.PDF_EXTRACT_WORKERS = workers
+    pdf_extract.PDF_PARALLEL_MIN_PAGES = 0
+    pdf_extract._pool = None
+    if workers > 1:
+        # Start the workers outside the timed run, as a long-lived server would
+        list(pdf_extract.iter_pages(path, pdf_extract.PDF_SHARD_PAGES * workers))
+    t0 = time.perf_counter()
+    pages = list(pdf_extract.iter_pages(path))
+    seconds = time.perf_counter() - t0
+    if pdf_extract._pool is not None:
+        pdf_extract._pool.shutdown()
+    return pages, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="existing PDF to extract instead of a generated one")
+    parser.add_argument("--pages", type=int, default=600)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.pdf
+        if not path:
+            path = os.path.join(tmp, "bench.pdf")
+            write_text_pdf(path, args.pages)
+        total = pdf_extract.page_count(path)
+        print(f"{total} pages, {os.path.getsize(path) / 1024:.0f} KB, shard={pdf_extract.PDF_SHARD_PAGES} pages")
+        print(f"{'workers':>8} {'seconds':>8} {'pages/s':>8} {'speedup':>8}")
+
+        baseline_pages, baseline = None, None
+        for workers in args.workers:
+            pages, seconds = _run(path, workers)
+            if baseline_pages is None:
+                baseline_pages, baseline = pages, seconds
+            elif pages != baseline_pages:
+                print(f"  workers={workers}: page text or order differs from the single-process run")
+            print(f"{workers:>8} {seconds:>8.2f} {total / seconds:>8.1f} {baseline / seconds:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
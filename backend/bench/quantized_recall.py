@@ -0,0 +1,85 @@
+# bench/quantized_recall.py
+"""
+Memory / storage and recall@k of the quantized local index
+(VECTOR_INDEX_QUANTIZATION=float16|int8) against exact float32 search,
+on a synthetic clustered corpus.
+
+    python bench/quantized_recall.py --rows 200000 --rerank 1 2 4 8
+
+"scanned MB" is what a query reads (and what stays hot in the page
+cache); "disk MB" is everything in the index directory. A rerank factor
+of 1 ranks by the compact codes alone.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+from ann_recall import clustered  # noqa: E402
+from app.quantized_index import QuantizedVectorIndex  # noqa: E402
+from app.vector_index import UserVectorIndex  # noqa: E402
+
+
+def _dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _build(index, data: np.ndarray):
+    for start in range(0, len(data), 5000):
+        index.add([
+            {"content": str(i), "embedding": v, "file_id": f"f{i // 5000}", "metadata": {"chunk_index": i}}
+            for i, v in enumerate(data[start:start + 5000], start=start)
+        ])
+    return index
+
+
+def _run(index, queries, truth, top_k: int):
+    index.search_many(queries[:1], top_k)
+    t0 = time.perf_counter()
+    results = index.search_many(queries, top_k)
+    qps = len(queries) / (time.perf_counter() - t0)
+    hits = sum(len({r["content"] for r in found} & expected) for found, expected in zip(results, truth))
+    return hits / (len(queries) * top_k), qps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = clustered(rng, args.rows, args.dim, clusters=max(8, args.rows // 500))
+    queries = clustered(rng, args.queries, args.dim, clusters=args.queries)
+
+    with tempfile.TemporaryDirectory() as root:
+        flat = _build(UserVectorIndex(os.path.join(root, "float32")), data)
+        truth = [{r["content"] for r in found} for found in flat.search_many(queries, args.top_k)]
+        _, exact_qps = _run(flat, queries, truth, args.top_k)
+        print(f"rows {args.rows}  dim {args.dim}  queries {args.queries}")
+        print(f"{'format':>8} {'rerank':>6} {'scanned MB':>11} {'disk MB':>8} "
+              f"{'recall@' + str(args.top_k):>10} {'QPS':>8}")
+        print(f"{'float32':>8} {'-':>6} {flat.matrix.nbytes / 1e6:>11.1f} {_dir_bytes(flat.path) / 1e6:>8.1f} "
+              f"{1.0:>10.3f} {exact_qps:>8.1f}")
+
+        for dtype in ("float16", "int8"):
+            index = _build(QuantizedVectorIndex(os.path.join(root, dtype), dtype=dtype), data)
+            scanned_mb = index.footprint()["scanned_bytes"] / 1e6
+            for factor in args.rerank:
+                index.rerank_factor = factor
+                recall, qps = _run(index, queries, truth, args.top_k)
+                print(f"{dtype:>8} {factor:>6} {scanned_mb:>11.1f} {_dir_bytes(index.path) / 1e6:>8.1f} "
+                      f"{recall:>10.3f} {qps:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# bench/retrieval_backends.py
+"""
+Search latency of the local NumPy vector index on synthetic per-user
+corpora, optionally compared with the Supabase match_documents_user RPC.
+
+    python bench/retrieval_backends.py --sizes 1000 5000 20000
+    python bench/retrieval_backends.py --rpc-user-id <user_id>   # needs SUPABASE_* env
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.vector_index import VectorIndexStore  # noqa: E402
+
+DIM = 768
+
+
+def _rows(vectors: np.ndarray, file_id: str) -> list:
+    return [
+        {
+            "content": f"chunk {i}",
+            "embedding": v.tolist(),
+            "file_id": file_id,
+            "metadata": {"source": "bench.pdf", "page_number": i // 10, "chunk_index": i},
+        }
+        for i, v in enumerate(vectors)
+    ]
+
+
+def _timed(fn, queries: np.ndarray) -> list:
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        fn(q)
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--rpc-user-id", help="also time the Supabase RPC for this user")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, DIM)).astype(np.float32)
+
+    print(f"{'backend':>10} {'chunks':>8} {'p50 ms':>8} {'p95 ms':>8} {'cold ms':>8}")
+    with tempfile.TemporaryDirectory() as root:
+        for n in args.sizes:
+            store = VectorIndexStore(root=root)
+            user_id = f"bench-{n}"
+            vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+            for start in range(0, n, 500):
+                store.add(user_id, _rows(vectors[start:start + 500], "f1"))
+
+            # Fresh store: first query pays the lazy load + memory map
+            store = VectorIndexStore(root=root)
+            t0 = time.perf_counter()
+            store.search(user_id, queries[0], args.top_k)
+            cold = time.perf_counter() - t0
+
+            lat = sorted(_timed(lambda q: store.search(user_id, q, args.top_k), queries))
+            print(f"{'local':>10} {n:>8} {statistics.median(lat) * 1000:>8.2f} "
+                  f"{lat[int(len(lat) * 0.95)] * 1000:>8.2f} {cold * 1000:>8.2f}")
+
+    if args.rpc_user_id:
+        from app.db import supabase
+
+        def rpc(q):
+            supabase.rpc(
+                "match_documents_user",
+                {"query_embedding": q.tolist(), "match_count": args.top_k, "p_user_id": args.rpc_user_id},
+            ).execute()
+
+        lat = sorted(_timed(rpc, queries[:50]))
+        print(f"{'rpc':>10} {'-':>8} {statistics.median(lat) * 1000:>8.2f} "
+              f"{lat[int(len(lat) * 0.95)] * 1000:>8.2f} {'-':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 #  CHECKPOINT WORKING Fully functional
 import streamlit as st
+import json
+import time
 import requests
-from utils import get_auth_headers
+from config import BACKEND_URL
+from utils import get_auth_headers, get_files
 
 st.set_page_config(page_title="Campus Knowledge Agent", page_icon="🎓", layout="wide")
 
@@ -32,6 +35,8 @@ st.sidebar.title("📚 Navigation")
 page = st.sidebar.radio("Go to", ["Home", "Ask", "Upload", "Files"])
 
 headers = get_auth_headers()
+# Files shown per page on the Files page
+FILES_PER_PAGE = 20
 
 # ------------------ Theme Colors ------------------
 if st.get_option("theme.base") == "dark":
@@ -72,9 +77,8 @@ if page == "Home":
     """, unsafe_allow_html=True)
 
     try:
-        resp = requests.get("http://localhost:8000/files", headers=headers)
-        if resp.status_code == 200:
-            files = resp.json().get("files", [])
+        files = get_files(headers)
+        if files is not None:
             if files:
                 st.markdown(f"<h3 style='color:#4B8BBE;'>📂 Your Uploaded Files ({len(files)})</h3>", unsafe_allow_html=True)
                 for f in files:
@@ -135,16 +139,33 @@ elif page == "Ask":
         """, unsafe_allow_html=True)
 
         try:
-            response = requests.post(
-                "http://localhost:8000/ask",
+            # Render answer tokens as /ask/stream sends them
+            with requests.post(
+                "http://localhost:8000/ask/stream",
                 json={"question": st.session_state["chat_history"][-1]["text"], "top_k": 4},
-                headers=headers
-            )
-            if response.status_code == 200:
-                data = response.json()
-                st.session_state["chat_history"].append({"role": "bot", "text": data.get("answer", "No answer found")})
-            else:
-                st.session_state["chat_history"].append({"role": "bot", "text": f"Error: {response.text}"})
+                headers=headers,
+                stream=True
+            ) as response:
+                if response.status_code == 200:
+                    answer, final = "", {}
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        frame = json.loads(line)
+                        if frame["type"] == "token":
+                            answer += frame["text"]
+                            placeholder.markdown(f"""
+                                <div style='text-align:left; margin:5px 0;'>
+                                    <span style='background-color:{BOT_BUBBLE}; padding:10px 15px; border-radius:15px;
+                                                 display:inline-block; max-width:70%; word-wrap:break-word;'>{answer}▌</span>
+                                </div>
+                            """, unsafe_allow_html=True)
+                        elif frame["type"] == "done":
+                            final = frame
+                    text = final.get("answer") or final.get("clarification_question") or answer or "No answer found"
+                    st.session_state["chat_history"].append({"role": "bot", "text": text.strip()})
+                else:
+                    st.session_state["chat_history"].append({"role": "bot", "text": f"Error: {response.text}"})
         except Exception as e:
             st.session_state["chat_history"].append({"role": "bot", "text": f"Error: {e}"})
         placeholder.empty()
@@ -158,13 +179,36 @@ elif page == "Upload":
         files = {"file": (uploaded_file.name, uploaded_file.getbuffer(), "application/pdf")}
         try:
             resp = requests.post(
-                "http://localhost:8000/upload",
+                f"{BACKEND_URL}/upload",
                 files=files,
                 headers=headers
             )
             if resp.status_code == 200:
                 st.success(f"Uploaded: {uploaded_file.name}")
-                st.json(resp.json())
+                job_id = resp.json()["job_id"]
+                progress = st.progress(0, text="Queued for processing...")
+                while True:
+                    job_resp = requests.get(f"{BACKEND_URL}/jobs/{job_id}", headers=headers)
+                    if job_resp.status_code != 200:
+                        # e.g. 404: the job is held by another backend worker, or was pruned
+                        job = None
+                        break
+                    job = job_resp.json()
+                    pages, total = job.get("pages_done", 0), job.get("pages_total")
+                    if total:
+                        progress.progress(
+                            min(pages / total, 1.0),
+                            text=f"Processed {pages}/{total} pages ({job.get('chunks_done', 0)} chunks)"
+                        )
+                    if job.get("status") in ("completed", "failed"):
+                        break
+                    time.sleep(1)
+                if job is None:
+                    st.error(f"Could not get the processing status ({job_resp.status_code}): {job_resp.text}")
+                elif job["status"] == "completed":
+                    progress.progress(1.0, text="Processed and stored successfully.")
+                else:
+                    st.error(f"Processing failed: {job.get('error')}")
             else:
                 st.error(f"Upload failed: {resp.text}")
         except Exception as e:
@@ -174,19 +218,33 @@ elif page == "Upload":
 elif page == "Files":
     st.markdown("<h1 style='color:#4B8BBE;'>📄 Uploaded Files</h1>", unsafe_allow_html=True)
     try:
-        resp = requests.get("http://localhost:8000/files", headers=headers)
-        if resp.status_code == 200:
-            files = resp.json().get("files", [])
+        files = get_files(headers)
+        if files is not None:
             if not files:
                 st.info("No files uploaded yet.")
-            for f in files:
+            elif st.button(f"Delete all {len(files)} files"):
+                del_resp = requests.delete(
+                    "http://localhost:8000/files",
+                    json={"file_ids": [f['file_id'] for f in files]},
+                    headers=headers
+                )
+                if del_resp.status_code == 200:
+                    st.success(f"Deleted {len(del_resp.json().get('deleted', []))} files")
+                    st.rerun()
+                else:
+                    st.error(f"Delete failed: {del_resp.text}")
+            # Pages are sliced from the cached listing, no request per page
+            page_count = max(1, -(-len(files) // FILES_PER_PAGE))
+            page_no = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1) \
+                if page_count > 1 else 1
+            for f in files[(page_no - 1) * FILES_PER_PAGE:page_no * FILES_PER_PAGE]:
                 st.markdown(f"""
                     <div style='border:1px solid {CARD_BORDER}; padding:10px; border-radius:10px; margin-bottom:10px; background-color:{CARD_BG};'>
                         <b>Filename:</b> {f['filename']} <br>
                         <b>Uploaded At:</b> {f.get('uploaded_at', 'N/A')}
                     </div>
                 """, unsafe_allow_html=True)
-                if st.button(f"Delete {f['filename']}"):
+                if st.button(f"Delete {f['filename']}", key=f"delete-{f['file_id']}"):
                     del_resp = requests.delete(
                         "http://localhost:8000/files",
                         json={"file_ids": [f['file_id']]},
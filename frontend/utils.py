@@ -1,4 +1,6 @@
+import requests
 import streamlit as st
+from config import BACKEND_URL
 #  CHECKPOINT WORKING Fully functional
 def get_auth_headers() -> dict:
     """
@@ -8,3 +10,38 @@ def get_auth_headers() -> dict:
     if "jwt_token" not in st.session_state:
         raise Exception("User not authenticated. Please login first.")
     return {"Authorization": f"Bearer {st.session_state['jwt_token']}"}
+
+# Files per GET /files request when rebuilding the cached listing
+FILES_PAGE_SIZE = 500
+
+def get_files(headers: dict):
+    """
+    Returns all of the user's files, or None if the backend refused.
+    The listing is kept in session_state with its ETag and the token it
+    was fetched with; on reruns the backend answers 304 until the user's
+    files change, and only then is the listing fetched again, page by page.
+    A different token (another login in the same session) starts over.
+    """
+    cached = st.session_state.get("files_cache")
+    if cached and cached["auth"] != headers.get("Authorization"):
+        cached = None
+    request_headers = dict(headers)
+    if cached:
+        request_headers["If-None-Match"] = cached["etag"]
+    resp = requests.get(f"{BACKEND_URL}/files", headers=request_headers, params={"limit": FILES_PAGE_SIZE})
+    if resp.status_code == 304:
+        return cached["files"]
+    if resp.status_code != 200:
+        return None
+    etag, data = resp.headers.get("ETag"), resp.json()
+    files = data["files"]
+    while data.get("next_cursor"):
+        page = requests.get(f"{BACKEND_URL}/files", headers=headers,
+                            params={"limit": FILES_PAGE_SIZE, "cursor": data["next_cursor"]})
+        if page.status_code != 200:
+            return None
+        data = page.json()
+        files.extend(data["files"])
+    if etag:
+        st.session_state["files_cache"] = {"auth": headers.get("Authorization"), "etag": etag, "files": files}
+    return files